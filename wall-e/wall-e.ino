@@ -111,6 +111,23 @@ char serialBuffer[MAX_SERIAL];
 uint8_t serialLength = 0;
 
 
+// Binary Protocol (switched on when the Pi sends "P1")
+// -- -- -- -- -- -- -- -- -- -- -- -- -- --
+// Frame: start byte, sequence number, payload length, payload, CRC-8 of the
+// sequence number, length and payload. The payload holds up to 10 commands
+// of 3 bytes each: the command letter and the number as int16 (little-endian)
+#define FRAME_START 0xA5   // Start of a frame from the Pi
+#define FRAME_ACK   0xA6   // Reply to a good frame, followed by its sequence number
+#define FRAME_NACK  0xA7   // Reply to a frame with a bad checksum
+#define MAX_FRAME   30     // Maximum payload length in bytes
+#define REPEAT_WINDOW 8    // Frames up to this far behind the last one run are repeats
+bool binaryMode = false;
+uint8_t lastSeq = 0;       // Sequence number of the last frame run (0 after "P1")
+uint8_t frameState = 0;
+uint8_t frameSeq, frameLength, frameIndex, frameCrc;
+uint8_t frameBuffer[MAX_FRAME];
+
+
 // ****** SERVO MOTOR CALIBRATION *********************
 // Servo Positions:  Low,High
 int preset[][2] =  {{618,362},  // head rotation
@@ -169,6 +186,10 @@ void setup() {
 	playAnimation(0);
 	softStart(queue.pop(), 3500);
 
+	// Discard what arrived while starting up (e.g. frames meant for the sketch
+	// before a reset); the Pi repeats its protocol request until it is answered
+	while (Serial.available() > 0) Serial.read();
+
 	Serial.println(F("Sartup complete; entering main loop"));
 }
 
@@ -180,6 +201,12 @@ void readSerial() {
 	// Read incoming byte
 	char inchar = Serial.read();
 
+	// In binary mode the bytes go to the frame parser instead
+	if (binaryMode) {
+		readFrame(inchar);
+		return;
+	}
+
 	// If the string has ended, evaluate the serial buffer
 	if (inchar == '\n' || inchar == '\r') {
 
@@ -206,6 +233,78 @@ void readSerial() {
 }
 
 
+// -------------------------------------------------------------------
+// 		READ BINARY FRAMES FROM SERIAL
+// -------------------------------------------------------------------
+uint8_t crc8(uint8_t crc, uint8_t data) {
+	// CRC-8, polynomial 0x07
+	crc ^= data;
+	for (uint8_t i = 0; i < 8; i++) crc = (crc & 0x80) ? (crc << 1) ^ 0x07 : crc << 1;
+	return crc;
+}
+
+void readFrame(uint8_t inbyte) {
+	switch (frameState) {
+		case 0:		// Wait for the start of a frame
+			if (inbyte == FRAME_START) frameState = 1;
+			break;
+
+		case 1:		// Sequence number
+			frameSeq = inbyte;
+			frameCrc = crc8(0, inbyte);
+			frameState = 2;
+			break;
+
+		case 2:		// Payload length; frames which cannot be valid are dropped
+			if (inbyte > MAX_FRAME || inbyte % 3 != 0) {
+				frameState = 0;
+				break;
+			}
+			frameLength = inbyte;
+			frameIndex = 0;
+			frameCrc = crc8(frameCrc, inbyte);
+			frameState = (frameLength > 0) ? 3 : 4;
+			break;
+
+		case 3:		// Payload
+			frameBuffer[frameIndex++] = inbyte;
+			frameCrc = crc8(frameCrc, inbyte);
+			if (frameIndex == frameLength) frameState = 4;
+			break;
+
+		case 4:		// Checksum; acknowledge the frame, then run its commands
+			frameState = 0;
+			if (inbyte != frameCrc) {
+				Serial.write(FRAME_NACK); Serial.write(frameSeq);
+				break;
+			}
+
+			// Frames run once each and in order (sequence numbers 1..255; 0 is
+			// the protocol request). A repeat, sent again because its ACK was
+			// lost, is only acknowledged; a frame after a gap is rejected, so
+			// that the Pi sends the missing frames first
+			if (frameSeq != 0) {
+				int behind = (lastSeq - frameSeq + 255) % 255;
+				if (behind < REPEAT_WINDOW) {
+					Serial.write(FRAME_ACK); Serial.write(frameSeq);
+					break;
+				}
+				if (frameSeq != lastSeq % 255 + 1) {
+					Serial.write(FRAME_NACK); Serial.write(frameSeq);
+					break;
+				}
+				lastSeq = frameSeq;
+			}
+			Serial.write(FRAME_ACK); Serial.write(frameSeq);
+			for (uint8_t i = 0; i < frameLength; i += 3) {
+				firstChar = frameBuffer[i];
+				evaluateCommand((int16_t) (frameBuffer[i+1] | (frameBuffer[i+2] << 8)));
+			}
+			break;
+	}
+}
+
+
 // -------------------------------------------------------------------
 // 		EVALUATE INPUT FROM SERIAL
 // -------------------------------------------------------------------
@@ -213,11 +312,30 @@ void evaluateSerial() {
 	// Evaluate integer number in the serial buffer
 	int number = atoi(serialBuffer);
 
+	// Protocol request: answered instead of echoed, so that the Pi can tell
+	// this sketch apart from one which only speaks ASCII
+	if (firstChar == 'P') {
+		if (number == 1) Serial.println(F("BIN1"));
+		evaluateCommand(number);
+		return;
+	}
+
 	Serial.print(firstChar); Serial.println(number);
+	evaluateCommand(number);
+}
+
+void evaluateCommand(int number) {
+	// Run the command in firstChar with its number argument
+
+	// Protocol selection: 1 = binary frames, 0 = ASCII lines
+	if (firstChar == 'P') {
+		binaryMode = (number == 1);
+		lastSeq = 0;
+	}
 
 	// Motor Inputs and Offsets
 	// -- -- -- -- -- -- -- -- -- -- -- -- -- --
-	if      (firstChar == 'X' && number >= -100 && number <= 100) turnVal = int(number * 2.55); 		// Forward/reverse control
+	else if (firstChar == 'X' && number >= -100 && number <= 100) turnVal = int(number * 2.55); 		// Forward/reverse control
 	else if (firstChar == 'Y' && number >= -100 && number <= 100) moveVal = int(number * 2.55); 		// Left/right control
 	else if (firstChar == 'S' && number >=  100 && number <= 100) turnOff = number; 					// Steering offset
 	else if (firstChar == 'O' && number >=    0 && number <= 250) curpos[9] = curpos[10] = int(number); 	// Motor deadzone offset
@@ -1,11 +1,11 @@
  # -*- coding:UTF-8 -*-
 
-import spidev
-
-import RPi.GPIO as GPIO
+import os
 
 import time
 
+import numpy as np
+
 #SSD1351
 SSD1351_WIDTH               = 128
 SSD1351_HEIGHT              = 128
@@ -54,52 +54,242 @@ WHITE   = 0xFFFF
 #buffer
 color_byte = [0x00, 0x00]
 color_fill_byte = [0x00, 0x00]*(SSD1351_WIDTH)
-
-
-#GPIO Set
-GPIO.setmode(GPIO.BCM)
-GPIO.setwarnings(False)
+#largest single transfer accepted by the spidev kernel driver (bufsiz)
+SPI_MAX_TRANSFER = 4096
+#shadow copy of the controller GRAM as RGB565 words, None while unknown
+Shadow_Frame = None
+#above this fraction of changed pixels a full-frame write is cheaper
+FULL_FRAME_THRESHOLD = 0.6
+#changed rows/columns closer than this are merged into a single window
+DIRTY_MERGE_GAP = 4
+#hardware scroll state and step intervals (HORIZSCROLL parameter E)
+Scrolling = False
+Start_Line = 0
+SCROLL_TEST     = 0x00
+SCROLL_NORMAL   = 0x01
+SCROLL_SLOW     = 0x02
+SCROLL_SLOWEST  = 0x03
+
+
+#GPIO pins
 OLED_RST_PIN = 25
 OLED_DC_PIN  = 24
 OLED_CS_PIN  = 8
-GPIO.setup(OLED_RST_PIN, GPIO.OUT)
-GPIO.setup(OLED_DC_PIN, GPIO.OUT)
-GPIO.setup(OLED_CS_PIN, GPIO.OUT)
-#GPIO init
-GPIO.setwarnings(False)
-GPIO.setup(OLED_RST_PIN, GPIO.OUT)
-GPIO.setup(OLED_DC_PIN, GPIO.OUT)
-GPIO.setup(OLED_CS_PIN, GPIO.OUT)
-#SPI init
-SPI = spidev.SpiDev(0, 0)
-SPI.max_speed_hz = 9000000
-SPI.mode = 0b00
+#SPI clock
+SPI_SPEED_HZ = 9000000
+
+
+class HardwareBackend():
+    """
+    Real panel: SPI through spidev and the RST/DC/CS lines through RPi.GPIO.
+    """
+    def __init__(self):
+        import spidev
+        import RPi.GPIO as GPIO
+        self.GPIO = GPIO
+        #GPIO init
+        GPIO.setmode(GPIO.BCM)
+        GPIO.setwarnings(False)
+        GPIO.setup(OLED_RST_PIN, GPIO.OUT)
+        GPIO.setup(OLED_DC_PIN, GPIO.OUT)
+        GPIO.setup(OLED_CS_PIN, GPIO.OUT)
+        #SPI init
+        self.spi = spidev.SpiDev(0, 0)
+        self.spi.max_speed_hz = SPI_SPEED_HZ
+        self.spi.mode = 0b00
+
+    def pin(self, pin, x):
+        if x == 1:
+            self.GPIO.output(pin, self.GPIO.HIGH)
+        elif x == 0:
+            self.GPIO.output(pin, self.GPIO.LOW)
+
+    def rst(self, x):
+        self.pin(OLED_RST_PIN, x)
+
+    def dc(self, x):
+        self.pin(OLED_DC_PIN, x)
+
+    def cs(self, x):
+        self.pin(OLED_CS_PIN, x)
+
+    def write(self, data):
+        # writebytes2 accepts any buffer and splits it itself; older spidev
+        # releases only have writebytes, which needs lists under the bufsiz limit
+        if hasattr(self.spi, "writebytes2"):
+            self.spi.writebytes2(data)
+        else:
+            for i in range(0, len(data), SPI_MAX_TRANSFER):
+                self.spi.writebytes(list(data[i:i+SPI_MAX_TRANSFER]))
+
+
+class EmulatorBackend():
+    """
+    In-memory SSD1351. Decodes the command stream into a GRAM framebuffer
+    and counts what would have crossed the bus (bytes, SPI writes, CS
+    transactions, DC toggles), so the driver can be tested and profiled on
+    any Linux box. With decode=False only the counters are kept.
+    """
+    def __init__(self, decode=True):
+        self.decode = decode
+        self.gram = np.zeros((SSD1351_HEIGHT, SSD1351_WIDTH), dtype=np.uint16)
+        self.reset_state()
+        self.reset_counters()
+
+    def reset_state(self):
+        self.dc_level = 0
+        self.command = None
+        self.args = bytearray()
+        self.columns = (0, SSD1351_WIDTH-1)
+        self.rows = (0, SSD1351_HEIGHT-1)
+        self.pointer = 0
+        self.pending = b''
+        self.start_line = 0
+        self.scroll = None
+        self.scrolling = False
+
+    def reset_counters(self):
+        self.bytes = 0
+        self.command_bytes = 0
+        self.data_bytes = 0
+        self.writes = 0
+        self.transactions = 0
+        self.dc_toggles = 0
+
+    def counters(self):
+        return {'bytes': self.bytes, 'command_bytes': self.command_bytes, 'data_bytes': self.data_bytes,
+                'writes': self.writes, 'transactions': self.transactions, 'dc_toggles': self.dc_toggles}
+
+    def rst(self, x):
+        if x == 0:
+            self.reset_state()
+
+    def dc(self, x):
+        if x != self.dc_level:
+            self.dc_toggles += 1
+        self.dc_level = x
+
+    def cs(self, x):
+        if x == 0:
+            self.transactions += 1
+
+    def write(self, data):
+        data = bytes(data)
+        self.writes += 1
+        self.bytes += len(data)
+        if self.dc_level == 0:
+            self.command_bytes += len(data)
+            if self.decode:
+                for cmd in data:
+                    self.start_command(cmd)
+        else:
+            self.data_bytes += len(data)
+            if not self.decode:
+                return
+            if self.command == SSD1351_CMD_WRITERAM:
+                self.write_pixels(data)
+            else:
+                self.args += data
+                self.apply_args()
+
+    def start_command(self, cmd):
+        self.command = cmd
+        self.args = bytearray()
+        if cmd == SSD1351_CMD_WRITERAM:
+            self.pointer = 0
+            self.pending = b''
+        elif cmd == SSD1351_CMD_STARTSCROLL:
+            self.scrolling = self.scroll is not None
+        elif cmd == SSD1351_CMD_STOPSCROLL:
+            self.scrolling = False
+
+    def apply_args(self):
+        if self.command == SSD1351_CMD_SETCOLUMN and len(self.args) == 2:
+            self.columns = (min(self.args[0], SSD1351_WIDTH-1), min(self.args[1], SSD1351_WIDTH-1))
+        elif self.command == SSD1351_CMD_SETROW and len(self.args) == 2:
+            self.rows = (min(self.args[0], SSD1351_HEIGHT-1), min(self.args[1], SSD1351_HEIGHT-1))
+        elif self.command == SSD1351_CMD_STARTLINE and len(self.args) == 1:
+            self.start_line = self.args[0] & 0x7F
+        elif self.command == SSD1351_CMD_HORIZSCROLL and len(self.args) == 5:
+            offset, row, rows = self.args[0], self.args[1], self.args[2]
+            if offset != 0:
+                self.scroll = (1 if offset < 64 else -1, row, rows)
+
+    def write_pixels(self, data):
+        data = self.pending + data
+        count = len(data) // 2
+        self.pending = data[count*2:]
+        x0, x1 = self.columns
+        y0, y1 = self.rows
+        width = x1 - x0 + 1
+        size = width * (y1 - y0 + 1)
+        if count == 0 or width <= 0 or size <= 0:
+            return
+        # the address pointer wraps inside the window, row by row
+        pos = (self.pointer + np.arange(count)) % size
+        self.gram[y0 + pos // width, x0 + pos % width] = np.frombuffer(data, dtype='>u2', count=count)
+        self.pointer = (self.pointer + count) % size
+
+    def advance_scroll(self, steps=1):
+        # Stand-in for the controller's scroll timer: rotate the scrolled rows
+        if self.scrolling:
+            direction, row, rows = self.scroll
+            band = self.gram[row:row+rows]
+            band[:] = np.roll(band, direction * steps, axis=1)
+
+    def frame(self):
+        # What the panel shows: GRAM rows start at the display start line
+        return np.roll(self.gram, -self.start_line, axis=0)
+
+
+def Default_Backend():
+    # OLED_BACKEND=emulator forces the emulator; otherwise the hardware is
+    # used and the emulator only stands in where spidev/RPi.GPIO are missing
+    if os.environ.get("OLED_BACKEND", "hardware") == "emulator":
+        return EmulatorBackend()
+    try:
+        return HardwareBackend()
+    except ImportError as e:
+        print("OLED: hardware backend unavailable (%s), using the emulator" % e)
+        return EmulatorBackend()
+
+Backend = Default_Backend()
+
+def Use_Backend(backend):
+    global Backend
+    Backend = backend
+    Invalidate_Shadow()
 
 
 def Set_Color(color):
     color_byte[0] = (color >> 8) & 0xff
     color_byte[1] = color & 0xff
 
+def Get_Color():
+    return (color_byte[0] << 8) | color_byte[1]
+
+def Invalidate_Shadow():
+    # Call after writing GRAM behind the driver's back; the next frame is
+    # then sent in full
+    global Shadow_Frame
+    Shadow_Frame = None
+
+def Shadow_Fill(x0, y0, x1, y1):
+    # Record that the window was filled with the current colour
+    if Shadow_Frame is not None:
+        Shadow_Frame[y0:y1+1, x0:x1+1] = Get_Color()
+
 def OLED_RST(x):
-    if x == 1:
-        GPIO.output(OLED_RST_PIN,GPIO.HIGH)
-    elif x == 0:
-        GPIO.output(OLED_RST_PIN,GPIO.LOW)
+    Backend.rst(x)
 
 def OLED_DC(x):
-    if x == 1:
-        GPIO.output(OLED_DC_PIN,GPIO.HIGH)
-    elif x == 0:
-        GPIO.output(OLED_DC_PIN,GPIO.LOW)
+    Backend.dc(x)
 
 def OLED_CS(x):
-    if x == 1:
-        GPIO.output(OLED_CS_PIN,GPIO.HIGH)
-    elif x == 0:
-        GPIO.output(OLED_CS_PIN,GPIO.LOW)
+    Backend.cs(x)
 
 def SPI_WriteByte(byte):
-    SPI.writebytes(byte)
+    Backend.write(byte)
 
 def Write_Command(cmd):
     OLED_CS(0)
@@ -119,34 +309,140 @@ def Write_Datas(data):
     SPI_WriteByte(data)
     OLED_CS(1)
 
-def RAM_Address():
-    Write_Command(0x15)
-    Write_Data(0x00)
-    Write_Data(0x7f)
-    Write_Command(0x75)
-    Write_Data(0x00)
-    Write_Data(0x7f)
+def SPI_WriteBulk(data):
+    Backend.write(data)
 
-def Fill_Color(color):
-    RAM_Address()
-    Write_Command(0x5c)
-    Set_Color(color)
-    color_fill_byte = color_byte*SSD1351_WIDTH
+def Write_Bulk(data):
     OLED_CS(0)
     OLED_DC(1)
-    for i in range(0,SSD1351_HEIGHT):
-        SPI_WriteByte(color_fill_byte)
+    SPI_WriteBulk(data)
     OLED_CS(1)
 
+class Transaction():
+    """
+    Builds a sequence of commands and data and sends it with CS held low
+    for the whole sequence, toggling DC only where the sequence switches
+    between command and data bytes. Small pieces are merged into one
+    buffer; large payloads are kept as they are and split to the spidev
+    transfer limit when flushed.
+    """
+    def __init__(self):
+        self.segments = []
+
+    def append(self, dc, payload):
+        if len(payload) < SPI_MAX_TRANSFER and self.segments:
+            last_dc, last = self.segments[-1]
+            if last_dc == dc and isinstance(last, bytearray) and len(last) < SPI_MAX_TRANSFER:
+                last += payload
+                return self
+        if len(payload) < SPI_MAX_TRANSFER:
+            payload = bytearray(payload)
+        self.segments.append((dc, payload))
+        return self
+
+    def command(self, cmd, *data):
+        self.append(0, bytes([cmd]))
+        if data:
+            self.append(1, bytes(data))
+        return self
+
+    def data(self, payload):
+        return self.append(1, payload)
+
+    def window(self, x0, y0, x1, y1):
+        # Select a GRAM window and start writing pixels into it
+        self.command(SSD1351_CMD_SETCOLUMN, x0, x1)
+        self.command(SSD1351_CMD_SETROW, y0, y1)
+        return self.command(SSD1351_CMD_WRITERAM)
+
+    def flush(self):
+        if not self.segments:
+            return
+        OLED_CS(0)
+        dc = None
+        for seg_dc, payload in self.segments:
+            if seg_dc != dc:
+                OLED_DC(seg_dc)
+                dc = seg_dc
+            SPI_WriteBulk(payload)
+        OLED_CS(1)
+        self.segments = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.flush()
+
+def Set_Start_Line(line):
+    # Vertical scroll of the whole panel: GRAM row 'line' is shown at the top.
+    # Costs one command, however much of the screen moves.
+    global Start_Line
+    Start_Line = line % SSD1351_HEIGHT
+    Transaction().command(SSD1351_CMD_STARTLINE, Start_Line).flush()
+
+def Start_Scroll(row, rows, direction=-1, speed=SCROLL_NORMAL):
+    # Let the controller rotate rows row..row+rows-1 sideways by one column
+    # per step (towards SEG0 for direction < 0) until Stop_Scroll, with no
+    # SPI traffic in between
+    global Scrolling
+    rows = min(rows, SSD1351_HEIGHT - row)
+    t = Transaction()
+    if Scrolling:
+        t.command(SSD1351_CMD_STOPSCROLL)
+    t.command(SSD1351_CMD_HORIZSCROLL, 0x01 if direction > 0 else 0x40, row, rows, 0x00, speed)
+    t.command(SSD1351_CMD_STARTSCROLL)
+    t.flush()
+    Scrolling = True
+
+def Stop_Scroll():
+    global Scrolling
+    if not Scrolling:
+        return
+    Transaction().command(SSD1351_CMD_STOPSCROLL).flush()
+    Scrolling = False
+    # the scrolled rows no longer match what was written
+    Invalidate_Shadow()
+
+def Stop_Effects():
+    # GRAM must not be written while the controller scrolls
+    Stop_Scroll()
+    if Start_Line != 0:
+        Set_Start_Line(0)
+
+def Display_Band(band, row):
+    # Write full-width rows of RGB565 words starting at the given row
+    Stop_Effects()
+    rows = min(band.shape[0], SSD1351_HEIGHT - row)
+    Transaction().window(0, row, SSD1351_WIDTH-1, row+rows-1).data(band[:rows].astype('>u2').tobytes()).flush()
+    if Shadow_Frame is not None:
+        Shadow_Frame[row:row+rows] = band[:rows]
+
+def Start_Ticker(band, row, direction=-1, speed=SCROLL_NORMAL):
+    # Write a band once and let the controller scroll it
+    Display_Band(band, row)
+    Start_Scroll(row, band.shape[0], direction, speed)
+
+def Fill_Window(x0, y0, x1, y1, color_pair):
+    # Fill a window with one colour (given as [high, low] bytes) in a single transaction
+    Stop_Effects()
+    pixels = (x1-x0+1)*(y1-y0+1)
+    Transaction().window(x0, y0, x1, y1).data(bytes(color_pair)*pixels).flush()
+
+def RAM_Address():
+    Transaction().command(SSD1351_CMD_SETCOLUMN, 0x00, 0x7f).command(SSD1351_CMD_SETROW, 0x00, 0x7f).flush()
+
+def Fill_Color(color):
+    Set_Color(color)
+    Fill_Window(0, 0, SSD1351_WIDTH-1, SSD1351_HEIGHT-1, color_byte)
+    global Shadow_Frame
+    Shadow_Frame = np.full((SSD1351_HEIGHT, SSD1351_WIDTH), color, dtype=np.uint16)
+
 def Clear_Screen():
-    RAM_Address()
-    Write_Command(0x5c)
-    color_fill_byte = [0x00, 0x00]*SSD1351_WIDTH
-    OLED_CS(0)
-    OLED_DC(1)
-    for i in range(0,SSD1351_HEIGHT):
-        SPI_WriteByte(color_fill_byte)
-    OLED_CS(1)
+    Fill_Window(0, 0, SSD1351_WIDTH-1, SSD1351_HEIGHT-1, [0x00, 0x00])
+    global Shadow_Frame
+    Shadow_Frame = np.zeros((SSD1351_HEIGHT, SSD1351_WIDTH), dtype=np.uint16)
 
 def Draw_Pixel(x, y):
     # Bounds check.
@@ -154,39 +450,29 @@ def Draw_Pixel(x, y):
         return
     if ((x < 0) or (y < 0)):
         return
-    Set_Address(x, y)
-    # transfer data
-    Write_Datas(color_byte)
+    Fill_Window(x, y, x, y, color_byte)
+    Shadow_Fill(x, y, x, y)
 
 def Set_Coordinate(x, y):
     if((x >= SSD1351_WIDTH) or (y >= SSD1351_HEIGHT)):
         return
     # Set x and y coordinate
-    Write_Command(SSD1351_CMD_SETCOLUMN)
-    Write_Data(x)
-    Write_Data(SSD1351_WIDTH-1)
-    Write_Command(SSD1351_CMD_SETROW)
-    Write_Data(y)
-    Write_Data(SSD1351_HEIGHT-1)
-    Write_Command(SSD1351_CMD_WRITERAM)
+    Transaction().window(x, y, SSD1351_WIDTH-1, SSD1351_HEIGHT-1).flush()
 
 
 def Set_Address(column, row):
-    Write_Command(SSD1351_CMD_SETCOLUMN)  
-    Write_Data(column)  #X start 
-    Write_Data(column)  #X end 
-    Write_Command(SSD1351_CMD_SETROW)
-    Write_Data(row)     #Y start 
-    Write_Data(row+7)   #Y end 
-    Write_Command(SSD1351_CMD_WRITERAM) 
+    Transaction().window(column, row, column, row+7).flush()
 
 def Write_text(dat):
+    Invalidate_Shadow()
+    pixels = bytearray()
     for i in range(0,8):
         if(dat & 0x01):
-            Write_Datas(color_byte)
+            pixels += bytes(color_byte)
         else:
-            Write_Datas([0x00,0x00])
+            pixels += bytes([0x00,0x00])
         dat = dat >> 1
+    Write_Datas(list(pixels))
 
 def Invert(v):
     if(v):
@@ -194,16 +480,6 @@ def Invert(v):
     else:
         Write_Command(SSD1351_CMD_NORMALDISPLAY)
 
-def Draw_Pixel(x, y):
-    # Bounds check.
-    if((x >= SSD1351_WIDTH) or (y >= SSD1351_HEIGHT)):
-        return
-    if((x < 0) or (y < 0)):
-        return
-    Set_Address(x, y)
-    # transfer data
-    Write_Datas(color_byte)
-
 def Delay(x):
     time.sleep(x / 1000.0)
 	
@@ -293,18 +569,9 @@ def Draw_FastHLine(x, y, length):
         length = SSD1351_WIDTH - x - 1
     if(length < 0):
         return
-    # set location
-    Write_Command(SSD1351_CMD_SETCOLUMN)
-    Write_Data(x)
-    Write_Data(x+length-1)
-    Write_Command(SSD1351_CMD_SETROW)
-    Write_Data(y)
-    Write_Data(y)
-    # fill!
-    Write_Command(SSD1351_CMD_WRITERAM)
-    
-    for i in range(0,length):
-        Write_Datas(color_byte)
+    # set location and fill!
+    Fill_Window(x, y, x+length-1, y, color_byte)
+    Shadow_Fill(x, y, x+length-1, y)
 
 
 def Draw_FastVLine(x, y, length):
@@ -316,23 +583,111 @@ def Draw_FastVLine(x, y, length):
         length = SSD1351_HEIGHT - y - 1
     if(length < 0):
         return
-    # set location
-    Write_Command(SSD1351_CMD_SETCOLUMN)
-    Write_Data(x)
-    Write_Data(x)
-    Write_Command(SSD1351_CMD_SETROW)
-    Write_Data(y)
-    Write_Data(y+length-1)
-    # fill!
-    Write_Command(SSD1351_CMD_WRITERAM)
-
-    for i in range(0,length):
-        Write_Datas(color_byte)
-
-def Display_Image(Image):
+    # set location and fill!
+    Fill_Window(x, y, x, y+length-1, color_byte)
+    Shadow_Fill(x, y, x, y+length-1)
+
+class FPS_Meter():
+    """
+    Rolling frames-per-second counter over the last few presented frames.
+    """
+    def __init__(self, window=30):
+        self.window = window
+        self.times = []
+        self.frames = 0
+
+    def tick(self):
+        self.times.append(time.monotonic())
+        if len(self.times) > self.window:
+            del self.times[0]
+        self.frames += 1
+
+    def fps(self):
+        if len(self.times) < 2:
+            return 0.0
+        return (len(self.times) - 1) / (self.times[-1] - self.times[0])
+
+    def reset(self):
+        self.times = []
+        self.frames = 0
+
+Display_FPS = FPS_Meter()
+
+def Image_To_RGB565(image):
+    # Accepts a PIL image or an HxWx3 uint8 array (RGB order) and returns a
+    # HxW uint16 array of RGB565 pixels in native byte order
+    if isinstance(image, np.ndarray):
+        pixels = image
+    else:
+        pixels = np.asarray(image.convert("RGB"))
+    pixels = pixels[:SSD1351_HEIGHT, :SSD1351_WIDTH]
+    r = pixels[..., 0].astype(np.uint16)
+    g = pixels[..., 1].astype(np.uint16)
+    b = pixels[..., 2].astype(np.uint16)
+    return ((r & 0xF8) << 8) | ((g & 0xFC) << 3) | (b >> 3)
+
+def Set_Window(x0, y0, x1, y1):
+    Transaction().window(x0, y0, x1, y1).flush()
+
+def Split_Runs(indices):
+    # Group sorted indices into (first, last) runs, bridging small gaps
+    breaks = np.flatnonzero(np.diff(indices) > DIRTY_MERGE_GAP)
+    starts = np.concatenate(([0], breaks + 1))
+    ends = np.concatenate((breaks, [len(indices) - 1]))
+    return [(int(indices[a]), int(indices[b])) for a, b in zip(starts, ends)]
+
+def Dirty_Windows(old, new):
+    # Bounding windows (x0, y0, x1, y1) covering every pixel that differs,
+    # split first into bands of rows and then into column groups in a band
+    changed = (old != new)
+    rows = np.flatnonzero(changed.any(axis=1))
+    if rows.size == 0:
+        return []
+    windows = []
+    for y0, y1 in Split_Runs(rows):
+        band = changed[y0:y1+1]
+        for x0, x1 in Split_Runs(np.flatnonzero(band.any(axis=0))):
+            band_rows = np.flatnonzero(band[:, x0:x1+1].any(axis=1))
+            windows.append((x0, y0 + int(band_rows[0]), x1, y0 + int(band_rows[-1])))
+    return windows
+
+def Display_Frame(frame, partial=True):
+    # frame is a HxW array of RGB565 words. Only the windows that differ from
+    # the shadow copy are sent, unless most of the screen has changed.
+    global Shadow_Frame
+    Stop_Effects()
+    windows = None
+    if partial and Shadow_Frame is not None:
+        windows = Dirty_Windows(Shadow_Frame, frame)
+        area = sum((x1-x0+1)*(y1-y0+1) for x0, y0, x1, y1 in windows)
+        if area > FULL_FRAME_THRESHOLD*SSD1351_WIDTH*SSD1351_HEIGHT:
+            windows = None
+
+    # all windows go out in one transaction; the controller expects the
+    # high byte of every pixel first
+    t = Transaction()
+    if windows is None:
+        t.window(0, 0, SSD1351_WIDTH-1, SSD1351_HEIGHT-1)
+        t.data(frame.astype('>u2').tobytes())
+    else:
+        for x0, y0, x1, y1 in windows:
+            t.window(x0, y0, x1, y1)
+            t.data(frame[y0:y1+1, x0:x1+1].astype('>u2').tobytes())
+    t.flush()
+    Shadow_Frame = np.array(frame, dtype=np.uint16)
+    Display_FPS.tick()
+
+def Display_Image(Image, partial=True):
+    if(Image is None):
+        return
+    Display_Frame(Image_To_RGB565(Image), partial)
+
+def Display_Image_Legacy(Image):
+    # Original per-pixel conversion, kept to compare against Display_Image
     if(Image == None):
         return
     
+    Stop_Effects()
     Set_Coordinate(0,0)
     buffer1 = Image.load()
     for j in range(0, SSD1351_WIDTH):
@@ -340,15 +695,17 @@ def Display_Image(Image):
             color_fill_byte[i*2] = ((buffer1[i,j][0] & 0xF8)|(buffer1[i,j][1] >> 5))
             color_fill_byte[i*2+1] = (((buffer1[i,j][1] << 3) & 0xE0)|(buffer1[i,j][2] >> 3))
         Write_Datas(color_fill_byte)
-            
-
-
-
-
-
-
-
-
-
-
-
+    global Shadow_Frame
+    Shadow_Frame = Image_To_RGB565(Image)
+    Display_FPS.tick()
+
+def Compare_Display_Paths(Image, frames=20):
+    # Push the same image through both paths and return (legacy fps, fast fps)
+    results = []
+    for display in (Display_Image_Legacy, Display_Image):
+        start = time.monotonic()
+        for i in range(0, frames):
+            Invalidate_Shadow()
+            display(Image)
+        results.append(frames / (time.monotonic() - start))
+    return tuple(results)
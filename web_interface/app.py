@@ -4,8 +4,7 @@
 # V1.4, 16th February 2020
 #############################################
 
-from flask import Flask, request, session, redirect, url_for, jsonify, render_template
-import queue 		# for serial command queue
+from flask import Flask, request, session, redirect, url_for, jsonify, render_template, make_response
 import threading 	# for multiple threads
 import os
 import pygame		# for sound
@@ -15,7 +14,6 @@ import subprocess 	# for shell commands
 
 
 #--------------Driver Library-----------------#
-import RPi.GPIO as GPIO
 import OLED_Driver as OLED
 #--------------Image Library---------------#
 from PIL  import Image
@@ -28,15 +26,25 @@ import cv2
 import numpy as np
 import time
 
-import gtts
 
 
 import getopt
-import scipy.io.wavfile as wavfile
 import math
 import sys
-import pydub 
 from waveshaper import Waveshaper
+from ringmod import diode_lookup, diode_pair, robotvoice_blocks, robotvoice_samples
+from ttscache import PhraseCache, phrase_key
+from ttsbackend import TTSRouter, GTTSBackend, EspeakBackend
+from ttsqueue import TTSQueue
+from arduinolink import ArduinoLink, CommandQueue
+from soundbank import SoundBank
+from soundlibrary import SoundLibrary
+import hashlib
+from videocache import VideoCache
+from framepacer import FramePacer, MusicClock
+from batteryscreen import BatteryScreen
+from displayservice import DisplayService, PRIORITY_STATUS, PRIORITY_VIDEO
+from ticker import TextTicker
 
 app = Flask(__name__)
 
@@ -44,9 +52,16 @@ app = Flask(__name__)
 ##### VARIABLES WHICH YOU CAN MODIFY #####
 loginPassword = "12345"                                  # Password for web-interface
 arduinoPort = "ARDUINO"                                              # Default port which will be selected
+arduinoProtocol = "auto"                                             # "auto" uses binary frames if the sketch supports them, "ascii" never does
 streamScript = "/home/pi/mjpg-streamer.sh"                           # Location of script used to start/stop video stream
 soundFolder = "/home/pi/walle-replica/web_interface/static/sounds/"  # Location of the folder containing all audio files
 oledFolder = "/home/pi/walle-replica/web_interface/oled/"  # Location of the folder containing all audio files
+videoCacheFolder = "/home/pi/walle-replica/web_interface/oled/cache/"  # Location of the pre-transcoded OLED video frames
+ttsCacheFolder = "/home/pi/walle-replica/web_interface/static/sounds/tts/"  # Location of the cached robot voice phrases
+ttsCacheBytes = 256*1024*1024                                        # Disk budget of the robot voice cache
+ttsPrewarm = [("en", "Hello, my name is Wall-E")]                    # Phrases (language, text) rendered at boot
+soundBankBytes = 64*1024*1024                                        # Memory for decoded sound clips
+soundChannels = 8                                                    # Number of sound clips which can play at once
 app.secret_key = os.environ.get("SECRET_KEY") or os.urandom(24)      # Secret key used for login session cookies
 
 
@@ -67,72 +82,59 @@ H = 1
 LOOKUP_SAMPLES = 1024
 # Frequency (in Hz) of modulating frequency
 MOD_F = 50
-
-
-# Start sound mixer
+# "lookup" uses the LOOKUP_SAMPLES table, "exact" evaluates the diode curve per sample
+DIODE_MODE = "lookup"
+# Table lookup: "nearest" bin or "linear" interpolation between bins
+LOOKUP_INTERPOLATION = "nearest"
+# Process and play speech in blocks of STREAM_BLOCK samples as it is decoded
+VOICE_STREAMING = True
+STREAM_BLOCK = 4096
+# Streamed phrases longer than this (in seconds) are not kept in the phrase cache
+STREAM_CACHE_SECONDS = 60
+# Speech synthesis: "gtts" (online), "espeak" (espeak-ng, offline) or "auto",
+# which uses gtts but falls back to espeak when gtts fails or is slow
+TTS_BACKEND = "auto"
+# In auto mode, seconds to wait for the first audio before trying the next backend
+TTS_FIRST_BLOCK_TIMEOUT = 3.0
+
+
+# Start sound mixer; channel 0 is kept for speech
 pygame.mixer.init()
+pygame.mixer.set_reserved(1)
 
 # Set up runtime variables and queues
-exitFlag = 0
 arduinoActive = 0
+arduinoLink = None
 streaming = 0
 volume = 5
 batteryLevel = -999
 queueLock = threading.Lock()
-workQueue = queue.Queue()
-threads = []
+# Sent by priority (stop, drive, servo, settings); setpoints (drive, servos,
+# offsets) are coalesced, other commands queued in order within their class
+workQueue = CommandQueue()
 videothreads = []
-videoFlag = 0
-stopVideo = 0
+videoCache = VideoCache(soundFolder, videoCacheFolder)
+videoStats = {}
+batteryScreen = BatteryScreen(oledFolder, OLED.Image_To_RGB565)
+# Only the display service writes to the OLED once it has been started
+displayService = DisplayService(OLED)
+statusToken = displayService.acquire(PRIORITY_STATUS, "status")
+ttsChannel = pygame.mixer.Channel(0)
+soundBank = SoundBank(soundFolder, soundBankBytes, soundChannels, first_channel=1)
+movieAudio = None
+soundLibrary = SoundLibrary(soundFolder)
+ttsCache = PhraseCache(ttsCacheFolder, disk_bytes=ttsCacheBytes)
+ttsRouter = TTSRouter([GTTSBackend(), EspeakBackend()], TTS_BACKEND, TTS_FIRST_BLOCK_TIMEOUT)
+ttsQueue = TTSQueue(lambda job: SpeakJob(job))	# SpeakJob is defined further down
+ticker = TextTicker(OLED, oledFolder + 'cambriab.ttf')
 #############################################
 # Set up the multithreading stuff here
 #############################################
-# The second thread will be used to send data to the Arduino
-class arduino (threading.Thread):
-	def __init__(self, threadID, name, q, port):
-		threading.Thread.__init__(self)
-		self.threadID = threadID
-		self.name = name
-		self.q = q
-		self.port = port
-	def run(self):
-		print("Starting Arduino Thread", self.name)
-		process_data(self.name, self.q, self.port)
-		print("Exiting Arduino Thread", self.name)
-
-# Function to send data to the Arduino from a buffer queue
-def process_data(threadName, q, port):
-	global exitFlag
-	
-	ser = serial.Serial(port,115200)
-	ser.flushInput()
-	dataString = ""
-	while not exitFlag:
-		try:
-			queueLock.acquire()
-			if not workQueue.empty():
-				data = q.get() + '\n'
-				queueLock.release()
-				ser.write(data.encode())
-				print(data)
-			else:
-				queueLock.release()
-			if (ser.inWaiting() > 0):
-				data = ser.read()
-				if (data.decode() == '\n' or data.decode() == '\r'):
-					print(dataString)
-					parseArduinoMessage(dataString)
-					dataString = ""
-				else:
-					dataString += data.decode()
-			if (videoFlag == 1):
-				print("A video is already active,sleeping queue")
-				time.sleep(0.100)
-		# If an error occured in the Arduino Communication
-		except Exception as e: 
-			print(e)
-			exitFlag = 1
-	ser.close()
+# The Arduino link runs its own writer and reader threads, which block
+# on the command queue and the serial port instead of polling them
+def onArduinoLine(dataString):
+	print(dataString)
+	parseArduinoMessage(dataString)
 
 # Function to parse messages received from the Arduino
 def parseArduinoMessage(dataString):
@@ -156,41 +158,34 @@ def parseArduinoMessage(dataString):
 # Turn on/off the Arduino Thread system
 def onoff_arduino(q, portNum):
 	global arduinoActive
-	global exitFlag
-	global threads
+	global arduinoLink
 	global batteryLevel
 	
 	if not arduinoActive:
-		# Set up thread and connect to Arduino
-		exitFlag = 0
-
+		# Set up threads and connect to Arduino
 		usb_ports = [
 			p.device
 			for p in serial.tools.list_ports.comports()
 		]
 		
-		thread = arduino(1, "Arduino", q, usb_ports[portNum])
-		thread.start()
-		threads.append(thread)
+		arduinoLink = ArduinoLink(usb_ports[portNum], q, onArduinoLine, protocol = arduinoProtocol)
+		arduinoLink.start()
 
 		arduinoActive = 1
 
 	else:
-		# Disconnect Arduino and exit thread
-		exitFlag = 1
+		# Disconnect Arduino and exit threads
+		arduinoLink.stop()
 		batteryLevel = -999
 
 		# Clear the queue
 		queueLock.acquire()
-		while not workQueue.empty():
-			q.get()
+		q.clear()
 		queueLock.release()
 
-		# Join any active threads up
-		for t in threads:
-			t.join()
-
-		threads = []
+		# Join the link threads up
+		arduinoLink.join()
+		arduinoLink = None
 		arduinoActive = 0
 
 	return 0
@@ -199,12 +194,11 @@ def onoff_arduino(q, portNum):
 # Test whether the Arduino connection is still active
 def test_arduino():
 	global arduinoActive
-	global exitFlag
 	global workQueue
 	
-	if arduinoActive and not exitFlag:
+	if arduinoActive and arduinoLink.alive:
 		return 1
-	elif exitFlag and arduinoActive:
+	elif arduinoActive:
 		onoff_arduino(workQueue, 0)
 	else:
 		return 0
@@ -250,41 +244,11 @@ def index():
 	if session.get('active') != True:
 		return redirect(url_for('login'))
 
-	# Get list of audio files
-	files = []
-	for item in sorted(os.listdir(soundFolder)):
-		if item.endswith(".ogg"):
-			audiofiles = os.path.splitext(os.path.basename(item))[0]
-			
-			# Set up default details
-			audiogroup = "Other"
-			audionames = audiofiles;
-			audiotimes = 0;
-			
-			# Get item details from name, and make sure they are valid
-			if len(audiofiles.split('_')) == 2:
-				if audiofiles.split('_')[1].isdigit():
-					audionames = audiofiles.split('_')[0]
-					audiotimes = float(audiofiles.split('_')[1])/1000.0
-				else:
-					audiogroup = audiofiles.split('_')[0]
-					audionames = audiofiles.split('_')[1]
-			elif len(audiofiles.split('_')) == 3:
-				audiogroup = audiofiles.split('_')[0]
-				audionames = audiofiles.split('_')[1]
-				if audiofiles.split('_')[2].isdigit():
-					audiotimes = float(audiofiles.split('_')[2])/1000.0
-			
-			# Add the details to the list
-			files.append((audiogroup,audiofiles,audionames,audiotimes))
+	# List of audio files as (group, file, name, seconds), kept up to date by the library index
+	files, filesTag = soundLibrary.refresh()
 	
 	# Get list of connected USB devices
-	ports = serial.tools.list_ports.comports()
-	usb_ports = [
-		p.description
-		for p in serial.tools.list_ports.comports()
-		#if 'ttyACM0' in p.description
-	]
+	usb_ports = [p.description for p in serial.tools.list_ports.comports()]
 	
 	# Ensure that the preferred Arduino port is selected by default
 	selectedPort = 0
@@ -292,7 +256,15 @@ def index():
 		if arduinoPort in item:
 			selectedPort = index
 	
-	return render_template('index.html',sounds=files,ports=usb_ports,portSelect=selectedPort,connected=arduinoActive)
+	# The page only changes with the sounds, the ports and the connection state
+	etag = hashlib.sha1(repr((filesTag, usb_ports, selectedPort, arduinoActive)).encode('utf-8')).hexdigest()
+	if etag in request.if_none_match:
+		response = make_response('', 304)
+	else:
+		response = make_response(render_template('index.html',sounds=files,ports=usb_ports,portSelect=selectedPort,connected=arduinoActive))
+	response.set_etag(etag)
+	response.headers['Cache-Control'] = 'private, no-cache'
+	return response
 
 # Login
 @app.route('/login')
@@ -404,16 +376,8 @@ def audio():
 
 	clip =  request.form.get('clip')
 	if clip is not None:
-		clip = soundFolder + clip + ".ogg"
 		print("Play music clip:", clip)
-		pygame.mixer.music.load(clip)
-		pygame.mixer.music.set_volume(volume/10.0)
-		#start_time = time.time()
-		pygame.mixer.music.play()
-		#while pygame.mixer.music.get_busy() == True:
-		#	continue
-		#elapsed_time = time.time() - start_time
-		#print(elapsed_time)
+		soundBank.play(clip, volume/10.0)
 		return jsonify({'status': 'OK' })
 	else:
 		return jsonify({'status': 'Error','msg':'Unable to read POST data'})
@@ -421,12 +385,8 @@ def audio():
 
 def playsoundclip(clipname):
 	if clipname is not None:
-		clip = soundFolder + clipname
-		print("Play music clip:", clip)
-		pygame.mixer.music.load(clip)
-		pygame.mixer.music.set_volume(volume/10.0)
-		#start_time = time.time()
-		pygame.mixer.music.play()
+		print("Play music clip:", clipname)
+		soundBank.play(os.path.splitext(clipname)[0], volume/10.0)
 
 
 # Play TTS
@@ -438,10 +398,27 @@ def tts():
 	lng =  request.form.get('lang')
 	txt =  request.form.get('txt')
 	if txt is not None:		
-		robotvoice(lng, txt)
-		return jsonify({'status': 'OK' })
+		# Spoken by the TTS thread; a newer text cancels the one before
+		job = ttsQueue.submit(lng, txt)
+		if job is None:
+			return jsonify({'status': 'Error','msg':'Too many TTS requests'})
+		return jsonify({'status': 'OK','job': job.id})
 	else:
 		return jsonify({'status': 'Error','msg':'Unable to read POST data'})
+
+# Progress of TTS jobs: one job when a job id is given, otherwise the recent ones
+@app.route('/ttsStatus', methods=['GET','POST'])
+def ttsStatus():
+	if session.get('active') != True:
+		return redirect(url_for('login'))
+
+	job = request.values.get('job')
+	if job is not None:
+		status = ttsQueue.status(job)
+		if status is None:
+			return jsonify({'status': 'Error','msg':'Unknown TTS job'})
+		return jsonify({'status': 'OK','job': status})
+	return jsonify({'status': 'OK','jobs': ttsQueue.status(),'cache': ttsCache.stats(),'backends': ttsRouter.stats()})
 	
 # Animate
 @app.route('/animate', methods=['POST'])
@@ -626,9 +603,21 @@ def arduinoStatus():
 				return jsonify({'status': 'OK','battery':batteryLevel})
 			else:
 				return jsonify({'status': 'Error','msg':'Arduino not connected'})
+		elif action == "link":
+			# Command counters and wait times per priority class, and the protocol in use
+			link = arduinoLink
+			return jsonify({'status': 'OK','connected': arduinoActive,'queue': workQueue.stats(),
+				'link': link.stats() if link else None})
 	
 	return jsonify({'status': 'Error','msg':'Unable to read POST data'})
 
+# Frame statistics of the most recent OLED video playback
+@app.route('/videoStatus', methods=['POST'])
+def videoStatus():
+	if session.get('active') != True:
+		return redirect(url_for('login'))
+
+	return jsonify({'status': 'OK','playing':displayService.active(PRIORITY_VIDEO),'stats':videoStats,'display':displayService.stats()})
 
 
 class videoPlayer (threading.Thread):
@@ -644,57 +633,25 @@ class videoPlayer (threading.Thread):
 
 def Display_Picture(File_Name):
     image = Image.open(File_Name)
-    OLED.Display_Image(image)
+    displayService.submit(statusToken, OLED.Image_To_RGB565(image))
+    batteryScreen.invalidate()
 
 def DisplayBatteryLevel():
-    global videoFlag
-    if ( videoFlag ==1  ):
-        return;
-    print("Will DisplayBatteryLevel")	
-    global batteryLevel
-	# oledFolder
-    #image = Image.new("RGB", (OLED.SSD1351_WIDTH, OLED.SSD1351_HEIGHT), "BLACK")
-    image = Image.open( oledFolder + 'bsun.jpg' )
-    draw = ImageDraw.Draw(image)
-    fontTitle = ImageFont.truetype(oledFolder + 'cambriab.ttf',10)
-    draw.text((16, 0), 'SOLAR CHARGE LEVEL', fill = "YELLOW", font = fontTitle)
-    
-    font = ImageFont.truetype(oledFolder + 'cambriab.ttf',8)    
-    #draw.text((0, 12), 'Level:' + str(batteryLevel), fill = "BLUE", font = font)
-    #draw.text((0, 36), 'Electronic', fill = "BLUE",font = font)
-    #draw.text((20, 72), '1.5 inch', fill = "CYAN", font = font)
-    #draw.text((10, 96), 'R', fill = "RED", font = font)
-    #draw.text((25, 96), 'G', fill = "GREEN", font = font)
-    #draw.text((40, 96), 'B', fill = "BLUE", font = font)
-    #draw.text((55, 96), ' OLED', fill = "CYAN", font = font)
-    
-    batteryLevelNorm = int(batteryLevel);
-    
-    #draw.rectangle([(0, 100), (101, 121)], fill = None, outline = "GREEN")
-    #draw.rectangle([(1, 101), (batteryLevelNorm, 120)], fill = "GREEN", outline = None)
-
-    if (batteryLevelNorm>110):
-        draw.text((0, 118), 'Charging ' + str(batteryLevel), fill = "BLUE", font = font)
-        batteryLevelNorm = 100
-    elif (batteryLevelNorm<0):
-        draw.text((0, 118), 'ERR:No Con ' +  str(batteryLevel), fill = "RED", font = font)
-        batteryLevelNorm = 0
-    else:
-        draw.text((0, 118), str(batteryLevel) + '%', fill = "WHITE", font = font)
-
-    bl = 0
-    for y in range(9, -1, -1):
-    	if (bl<batteryLevelNorm):
-    		draw.rectangle([(60, 25+y*10), (120, 34+y*10)], fill = "YELLOW", outline = "BLACK")
-    	bl = bl + 10
-   
-    if (batteryLevelNorm<4):
-       draw.rectangle([(60, 116), (120, 127)], fill = "BLACK", outline = "RED")
-       draw.text((64, 116), 'WARNING!', fill = "RED", font = fontTitle)
-
-    	
-    	
-    OLED.Display_Image(image)
+	print("Will DisplayBatteryLevel")
+	# Rendered frames are cached; nothing is submitted when the screen would not change.
+	# While a video plays the status layer stays hidden and shows again afterwards.
+	frame, changed = batteryScreen.render(batteryLevel)
+	if changed:
+		displayService.submit(statusToken, frame)
+
+def ShowTicker(text):
+	# Scrolled by the OLED controller on top of the status screen; videos hide it
+	displayService.show_ticker(ticker, text)
+
+def ShowIPAddress():
+	result = subprocess.run(['hostname', '-I'], stdout=subprocess.PIPE).stdout.decode('utf-8').split()
+	if result:
+		ShowTicker("IP " + result[0])
 
 def TryInitArduinoCon():
 	portNum = 0
@@ -715,193 +672,191 @@ def TryInitArduinoCon():
 		print(e)
 
 
-def PlayMovie(File_Name):
+def StopMovieAudio():
+	# The sound of the previous video, unless its channel went on to play something else
+	global movieAudio
+	if movieAudio is not None:
+		channel, sound = movieAudio
+		if channel is None:
+			pygame.mixer.music.stop()
+		elif channel.get_sound() is sound:
+			channel.stop()
+		movieAudio = None
 
-   global videoFlag
-   global stopVideo
-   if (videoFlag == 1):
-    print("A video is already active")
-    stopVideo = 1
-    while ( stopVideo == 1):
-     print("Waiting to stop previous")
-     time.sleep(1)
-    
-   videoFlag = 1
-   clip = soundFolder + File_Name + ".ogg"
-   print("Play music clip:", clip)
-   pygame.mixer.music.load(clip)
-   pygame.mixer.music.set_volume(volume/10.0)
-   pygame.mixer.music.play()
-   
-   videoclip = soundFolder + File_Name + ".webm"
-	
-   print("Play video clip:", videoclip)
-   
-   
-   captvid = cv2.VideoCapture(videoclip) #Enter the name of your video in here
-   #image = Image.new('1', (OLED.SSD1351_WIDTH, OLED.SSD1351_HEIGHT))
-   image = Image.new("RGB", (OLED.SSD1351_WIDTH, OLED.SSD1351_HEIGHT), "BLACK")
-   draw = ImageDraw.Draw(image)
-   frameCounter = 0
-   frameSkip = 2 #Change to adjust frame rate
-   lowerThresh = 0# Adjust threshold according to video
-   #image = Image.new("RGB", (OLED.SSD1351_WIDTH, OLED.SSD1351_HEIGHT), "YELLOW")
-   #OLED.Display_Image(image)
-   #OLED.Delay(1000)
-   while(captvid.isOpened()):
-       ret, frame = captvid.read()
-       frameStart = time.time()
-       if ret==True:
-           if frameCounter%frameSkip == 0:
-               # Import image as grayscale
-   ###            gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
-               resized = cv2.resize(frame, (OLED.SSD1351_WIDTH, OLED.SSD1351_HEIGHT))
-
-               # Resize to fit OLED screen dimensions
-   #            resized = cv2.resize(gray, (OLED.SSD1351_WIDTH, OLED.SSD1351_HEIGHT))
-   #            gray = cv2.cvtColor(resized, cv2.COLOR_BGR2GRAY)
-                # Threshold it to B&W
-   #               (thresh, bw) = cv2.threshold(gray, lowerThresh, 255, cv2.THRESH_BINARY+cv2.THRESH_OTSU)
-                # Clear screen for next frame
-               draw.rectangle((0, 0, OLED.SSD1351_WIDTH, OLED.SSD1351_HEIGHT), outline=0, fill=0)
-   ##            oled.fill(0)
-               # Convert to OLED format, and print
-   #            screenframe = Image.fromarray(bw).convert("1")
-   #            OLED.Display_Image(screenframe)
-               screenframe = Image.fromarray(resized)
-               OLED.Display_Image(screenframe)
-               frameEnd = time.time()
-               print(1/(frameEnd-frameStart))
-           frameCounter=frameCounter+1
-           if ( stopVideo == 1):
-             stopVideo = 0
-             videoFlag = 0
-             break
-       else:
-       	   videoFlag = 0
-           stopVideo = 0
-           print("Video end")
-           break
-
-   stopVideo = 0
-
-
-
-
-
-def diode_lookup(n_samples):
-    result = np.zeros((n_samples,))
-    for i in range(0, n_samples):
-        v = float(i - float(n_samples)/2)/(n_samples/2)
-        v = abs(v)
-        if v < VB:
-            result[i] = 0
-        elif VB < v <= VL:
-            result[i] = H * ((v - VB)**2)/(2*VL - 2*VB)
-        else:
-            result[i] = H*v - H*VL + (H*(VL-VB)**2)/(2*VL-2*VB)
-
-    return result
-
-def raw_diode(signal):
-    result = np.zeros(signal.shape)
-    for i in range(0, signal.shape[0]):
-        v = signal[i]
-        if v < VB:
-            result[i] = 0
-        elif VB < v <= VL:
-            result[i] = H * ((v - VB)**2)/(2*VL - 2*VB)
-    else:
-        result[i] = H*v - H*VL + (H*(VL-VB)**2)/(2*VL-2*VB)
-    return result
-
-
-def robotvoice(lng, txt):
-	tts = gtts.gTTS( txt , lang= lng)
-	clip = soundFolder + "txt.mp3"
-	tts.save(clip)
-	
 
-	"""
-	Program to make a robot voice by simulating a ring modulator;
-	procedure/math taken from
-	http://recherche.ircam.fr/pub/dafx11/Papers/66_e.pdf
-	"""
-	#clip = soundFolder + "sample.wav
-	import tempfile
-	mp3 = pydub.AudioSegment.from_mp3(clip)
-	clip = soundFolder + "txt.wav"
-	mp3.export(clip, format="wav")
-	left_channel =  pydub.AudioSegment.from_wav(clip)
-	right_channel =  pydub.AudioSegment.from_wav(clip)
-	audiofile = pydub.AudioSegment.from_mono_audiosegments(left_channel, right_channel)
-	audiofile.export(clip, format="wav")
-	print("Convert wav clip:", clip)
-	rate, data = wavfile.read(clip)
-
-	print(data)
-	length = data.shape[0] / rate
-	print(f"length = {length}s")
-
-	print(f"number of channels = {data.shape[1]}")
-
-	data = data[:,1]
-
-	# get max value to scale to original volume at the end
-	scaler = np.max(np.abs(data))
-
-	# Normalize to floats in range -1.0 < data < 1.0
-	data = data.astype(np.float)/scaler
-
-	# Length of array (number of samples)
-	n_samples = data.shape[0]
-
-	# Create the lookup table for simulating the diode.
-	d_lookup = diode_lookup(LOOKUP_SAMPLES)
-	diode = Waveshaper(d_lookup)
-
-	# Simulate sine wave of frequency MOD_F (in Hz)
-	tone = np.arange(n_samples)
-	tone = np.sin(2*np.pi*tone*MOD_F/rate)
-
-	# Gain tone by 1/2
-	tone = tone * 0.5
-
-        # Junctions here
-	tone2 = tone.copy() # to top path
-	data2 = data.copy() # to bottom path
-
-        # Invert tone, sum paths
-	tone = -tone + data2 # bottom path
-	data = data + tone2 #top path
-
-        #top
-	data = diode.transform(data) + diode.transform(-data)
-
-        #bottom
-	tone = diode.transform(tone) + diode.transform(-tone)
-
-	result = data - tone
-
-        #scale to +-1.0
-	result /= np.max(np.abs(result))
-        #now scale to max value of input file.
-	result *= scaler
-        # wavfile.write wants ints between +-5000; hence the cast
-	clip = soundFolder + "robot.wav"
-	wavfile.write(clip, rate, result.astype(np.int16))
-	print("Play TTS clip:", clip)
-	pygame.mixer.music.load(clip)
-	pygame.mixer.music.play()
+def PlayMovie(File_Name):
+	global videoStats, movieAudio
+	# Preempts any video still playing; its thread stops at its next frame
+	token = displayService.acquire(PRIORITY_VIDEO, File_Name, preempt=True)
+	# Released whatever happens; a leaked token would keep the video over the battery screen
+	try:
+		print("Play music clip:", File_Name)
+		StopMovieAudio()
+		channel = soundBank.play(File_Name, volume/10.0)
+		movieAudio = (channel, channel.get_sound() if channel is not None else None)
+		# Frames are scheduled against the music position so the two stay in sync;
+		# a clip played from the sound bank starts right away, so the wall clock follows it
+		clock = MusicClock(pygame.mixer.music if channel is None else None)
+
+		cachedclip = videoCache.open(File_Name)
+		if cachedclip is not None:
+			print("Play cached video clip:", File_Name)
+			pacer = FramePacer(cachedclip.fps, len(cachedclip), clock)
+			for i in pacer:
+				# copied, so the display thread never holds a view into the map
+				if not displayService.submit(token, cachedclip.frame(i).copy()):
+					break
+			cachedclip.close()
+		else:
+			# Not transcoded yet (or the source changed): decode this time, cache for next time
+			videoclip = soundFolder + File_Name + ".webm"
+			print("Play video clip:", videoclip)
+			captvid = cv2.VideoCapture(videoclip)
+			frameCount = int(captvid.get(cv2.CAP_PROP_FRAME_COUNT))
+			pacer = FramePacer(captvid.get(cv2.CAP_PROP_FPS) or 30.0, frameCount if frameCount > 0 else None, clock)
+			position = 0
+			for i in pacer:
+				# Frames dropped by the pacer are only grabbed, never converted or sent
+				while position < i and captvid.grab():
+					position += 1
+				ret, frame = captvid.read()
+				position += 1
+				if not ret:
+					break
+				resized = cv2.resize(frame, (OLED.SSD1351_WIDTH, OLED.SSD1351_HEIGHT))
+				# OpenCV frames are BGR
+				if not displayService.submit(token, OLED.Image_To_RGB565(cv2.cvtColor(resized, cv2.COLOR_BGR2RGB))):
+					break
+			captvid.release()
+	finally:
+		displayService.release(token)
+	# Transcoding decodes the whole clip again, so it only starts once no video is playing
+	if cachedclip is None and not displayService.active(PRIORITY_VIDEO):
+		videoCache.build_async(File_Name)
+	videoStats = pacer.stats.summary()
+	print("Video end", File_Name, videoStats)
+
+
+
+def voice_diode():
+	# Robot voice: a simulated ring modulator, see ringmod.py and
+	# http://recherche.ircam.fr/pub/dafx11/Papers/66_e.pdf
+	if DIODE_MODE == "exact":
+		return lambda x: diode_pair(x, VB, VL, H)
+	# lookup table for simulating the diode (built once, then memoized)
+	return Waveshaper(diode_lookup(LOOKUP_SAMPLES, VB, VL, H), LOOKUP_INTERPOLATION).transform_pair
+
+
+def render_voice(lng, txt, rate):
+	# The whole phrase in the current mode, e.g. to fill the cache; returns (key, samples)
+	backend, pcm = ttsRouter.open(lng, txt, rate, STREAM_BLOCK)
+	if not VOICE_STREAMING:
+		samples = robotvoice_samples(pcm, rate, MOD_F, voice_diode())
+		print(f"length = {samples.shape[0] / rate}s")
+	else:
+		blocks = list(robotvoice_blocks(pcm, rate, MOD_F, voice_diode()))
+		samples = np.concatenate(blocks) if blocks else np.zeros(0, dtype=np.int16)
+	return robotvoice_key(backend, lng, txt, rate), samples
+
+
+def robotvoice_key(backend, lng, txt, rate):
+	# Everything which changes the rendered audio
+	return phrase_key(lng, txt, VB, VL, H, MOD_F, LOOKUP_SAMPLES, DIODE_MODE, LOOKUP_INTERPOLATION,
+		VOICE_STREAMING, rate, backend)
+
+
+def cached_voice(lng, txt, rate):
+	# The phrase as rendered by the first backend (in the current order) which has it cached
+	return ttsCache.get_any([robotvoice_key(backend, lng, txt, rate) for backend in ttsRouter.candidates()])
+
+
+def voice_sound(samples, channels):
+	# the mixer wants 16 bit samples per channel
+	if channels > 1:
+		samples = np.repeat(samples[:, np.newaxis], channels, axis=1)
+	return pygame.sndarray.make_sound(samples)
+
+
+def queue_voice(sound, job):
+	# Queue a block behind the one playing; gives up once the job is cancelled
+	while not job.cancelled:
+		if ttsChannel.get_queue() is None:
+			ttsChannel.queue(sound)
+			return True
+		time.sleep(0.005)
+	return False
+
+
+def robotvoice(lng, txt, job):
+	# Rendered phrases come from ttsCache, so repeated phrases skip gTTS and the DSP
+	start_time = time.monotonic()
+	rate, size, channels = pygame.mixer.get_init()
+	ttsChannel.stop()
+	ttsChannel.set_volume(volume/10.0)
+	samples = cached_voice(lng, txt, rate)
+	job.update(cached = samples is not None)
+	if samples is None and not VOICE_STREAMING:
+		job.update(stage = "synthesizing")
+		samples = ttsCache.put(*render_voice(lng, txt, rate))
+	if samples is not None:
+		if samples.size and not job.cancelled:
+			ttsChannel.play(voice_sound(samples, channels))
+		job.update(stage = "playing", seconds = samples.size / rate,
+			first_audio_ms = round((time.monotonic() - start_time) * 1000))
+		print("Play TTS clip after %.0f ms" % ((time.monotonic() - start_time) * 1000), ttsCache.stats())
+		return
+
+	# Stream: each block is queued on the speech channel as soon as it is processed
+	job.update(stage = "synthesizing")
+	backend, pcm = ttsRouter.open(lng, txt, rate, STREAM_BLOCK)
+	job.update(backend = backend)
+	blocks = []
+	cached = 0
+	for block in robotvoice_blocks(pcm, rate, MOD_F, voice_diode()):
+		if not block.size:
+			continue
+		if cached == 0:
+			print("Play TTS stream after %.0f ms" % ((time.monotonic() - start_time) * 1000))
+			job.update(stage = "playing", first_audio_ms = round((time.monotonic() - start_time) * 1000))
+		if not queue_voice(voice_sound(block, channels), job):
+			pcm.close()
+			ttsChannel.stop()
+			return
+		cached += block.size
+		job.update(seconds = cached / rate)
+		if blocks is not None:
+			blocks.append(block)
+			if cached > STREAM_CACHE_SECONDS * rate:
+				blocks = None
+	if blocks:
+		ttsCache.put(robotvoice_key(backend, lng, txt, rate), np.concatenate(blocks))
+	print("TTS backends:", ttsRouter.stats())
+
+
+def SpeakJob(job):
+	ShowTicker(job.text)
+	robotvoice(job.lang, job.text, job)
+
+
+def PrewarmVoice():
+	rate = pygame.mixer.get_init()[0]
+	rendered = ttsCache.prewarm(([robotvoice_key(backend, lng, txt, rate) for backend in ttsRouter.candidates()],
+		lambda lng=lng, txt=txt: render_voice(lng, txt, rate)) for lng, txt in ttsPrewarm)
+	print("TTS cache prewarmed:", rendered, "new phrases", ttsCache.stats())
 
 if __name__ == '__main__':
 	#-------------OLED Init------------#
 	OLED.Device_Init()	
+	displayService.start()
+	ShowIPAddress()
 	thread = videoPlayer(1, "BandL")
 	thread.start()
 	videothreads.append(thread)	
+	soundBank.preload()
+	ttsQueue.start()
 	TryInitArduinoCon()
 	DisplayBatteryLevel()
+	threading.Thread(target=PrewarmVoice, name="TTS prewarm", daemon=True).start()
 	time.sleep(5)
 	playsoundclip("GR_myNameIsWallE.ogg")	
 	app.run(debug=False, host='0.0.0.0')
@@ -0,0 +1,613 @@
+import queue
+import re
+import struct
+import threading
+import time
+from collections import OrderedDict, deque
+
+LINE_END = re.compile(rb'[\r\n]')
+
+# Binary protocol (see readFrame in wall-e.ino): the Pi sends frames of
+# start byte, sequence number, payload length, payload and CRC-8; the
+# payload is up to MAX_FRAME_COMMANDS commands of letter + int16. The
+# Arduino answers each frame with two bytes, ACK or NACK and the sequence
+# number. Both markers are above 0x7f, so they cannot be mistaken for the
+# ASCII text the Arduino prints.
+FRAME_START = 0xA5
+FRAME_ACK = 0xA6
+FRAME_NACK = 0xA7
+FRAME_REPLY = re.compile(rb'([\xa6\xa7])(.?)', re.S)
+FRAME_COMMAND = struct.Struct('<ch')
+MAX_FRAME_COMMANDS = 10
+# The sketch acknowledges frames up to this far behind the last one it ran
+# as repeats, without running them again; the window must stay below it
+REPEAT_WINDOW = 8
+# Sent at connect ("auto" protocol): a sketch which speaks binary answers
+# BINARY_READY, an older one only echoes the command back
+HELLO = "P1"
+BINARY_READY = "BIN1"
+HELLO_SEQUENCE = 0
+# First line the sketch prints after a reset (see setup() in wall-e.ino)
+SKETCH_BANNER = "--- Wall-E Control Sketch ---"
+
+
+def _crc8_table():
+    table = []
+    for byte in range(256):
+        crc = byte
+        for _ in range(8):
+            crc = ((crc << 1) ^ 0x07) & 0xFF if crc & 0x80 else (crc << 1) & 0xFF
+        table.append(crc)
+    return bytes(table)
+
+
+CRC8_TABLE = _crc8_table()
+
+
+def crc8(data, crc=0):
+    # CRC-8 with polynomial 0x07, as computed by the sketch
+    for byte in data:
+        crc = CRC8_TABLE[crc ^ byte]
+    return crc
+
+
+def encode_command(data):
+    # "X-42" -> letter and int16; a missing number is 0, as atoi() makes it
+    letter, number = data[:1], data[1:].strip()
+    return FRAME_COMMAND.pack(letter.encode('ascii'), int(number) if number else 0)
+
+
+def encode_frame(sequence, payload):
+    body = bytes((sequence, len(payload))) + payload
+    return bytes((FRAME_START,)) + body + bytes((crc8(body),))
+
+# Commands which set a value (drive X/Y, steering and motor offsets, the
+# servo positions); only the latest value of each is worth sending
+SETPOINTS = frozenset("XYSO" + "GTBLREUJK")
+
+# Priority classes of outbound commands, most urgent first
+STOP, DRIVE, SERVO, SETTINGS = range(4)
+CLASS_NAMES = ("stop", "drive", "servo", "settings")
+DRIVE_COMMANDS = frozenset("XYwsad")
+SERVO_COMMANDS = frozenset("GTBLREUJK" + "jlikrtyufghbnm")
+WAIT_HISTORY = 256
+
+
+def command_class(data):
+    """
+    Priority class of a command: "q" and X/Y set to zero stop the motors,
+    other X/Y values and the WASD moves drive, servo positions and the
+    pose presets move servos; animations, modes and offsets are settings.
+    """
+    letter = data[:1]
+    if letter == 'q':
+        return STOP
+    if letter in "XY":
+        try:
+            if float(data[1:]) == 0:
+                return STOP
+        except ValueError:
+            pass
+    if letter in DRIVE_COMMANDS:
+        return DRIVE
+    if letter in SERVO_COMMANDS:
+        return SERVO
+    return SETTINGS
+
+
+def wait_stats(waits):
+    if not waits:
+        return {'mean_ms': None, 'p95_ms': None, 'max_ms': None}
+    ordered = sorted(waits)
+    return {
+        'mean_ms': round(sum(ordered) / len(ordered) * 1000, 3),
+        'p95_ms': round(ordered[int(0.95 * (len(ordered) - 1))] * 1000, 3),
+        'max_ms': round(ordered[-1] * 1000, 3),
+    }
+
+
+class CommandQueue():
+    """
+    Outbound commands for the Arduino, in priority classes (see
+    command_class): get() always returns a command of the most urgent class
+    which has one waiting, so a stop never waits behind servo moves or
+    animations. Within a class commands keep their order. A stop also
+    drops the drive commands queued before it, so that motion ordered
+    before the stop cannot run after it.
+
+    Setpoint commands (see SETPOINTS, keyed by their first letter) live in
+    one slot per channel: a new value overwrites one which has not been
+    sent yet and keeps its place in line (or moves up, when it belongs to a
+    more urgent class, e.g. X0 after X50), so a slow link never works
+    through stale joystick or slider positions. Everything else is sent
+    once each, from a queue of at most max_commands. The time every command
+    waited is recorded per class (the last WAIT_HISTORY of each). get()
+    follows the queue.Queue interface.
+    """
+    def __init__(self, setpoints=SETPOINTS, max_commands=64, classify=command_class):
+        self.setpoints = setpoints
+        self.max_commands = max_commands
+        self.classify = classify
+        self.cond = threading.Condition()
+        self.order = [deque() for _ in CLASS_NAMES]
+        self.slots = {}
+        self.commands = 0
+        self.coalesced = {}
+        self.dropped = 0
+        self.sent = 0
+        self.sent_by_class = [0] * len(CLASS_NAMES)
+        self.cancelled_drives = 0
+        self.waits = [deque(maxlen=WAIT_HISTORY) for _ in CLASS_NAMES]
+
+    def put(self, data):
+        channel = data[:1]
+        level = self.classify(data)
+        now = time.monotonic()
+        with self.cond:
+            if level == STOP:
+                self._cancel_drives()
+            if channel in self.setpoints:
+                if channel in self.slots:
+                    self.coalesced[channel] = self.coalesced.get(channel, 0) + 1
+                    _, queued_level, queued = self.slots[channel]
+                    if level < queued_level:
+                        self.order[queued_level].remove((channel, None, queued))
+                        self.order[level].append((channel, None, queued))
+                    else:
+                        level = queued_level
+                    self.slots[channel] = (data, level, queued)
+                else:
+                    self.order[level].append((channel, None, now))
+                    self.slots[channel] = (data, level, now)
+            else:
+                if self.commands >= self.max_commands:
+                    self.dropped += 1
+                    return
+                self.order[level].append((None, data, now))
+                self.commands += 1
+            self.cond.notify()
+
+    def _cancel_drives(self):
+        for queued_channel, data, queued in self.order[DRIVE]:
+            if queued_channel is not None:
+                del self.slots[queued_channel]
+            else:
+                self.commands -= 1
+            self.cancelled_drives += 1
+        self.order[DRIVE].clear()
+
+    def get(self, timeout=None):
+        with self.cond:
+            if not self.cond.wait_for(lambda: any(self.order), timeout):
+                raise queue.Empty
+            level = next(level for level, entries in enumerate(self.order) if entries)
+            channel, data, queued = self.order[level].popleft()
+            if channel is not None:
+                data = self.slots.pop(channel)[0]
+            else:
+                self.commands -= 1
+            self.waits[level].append(time.monotonic() - queued)
+            self.sent_by_class[level] += 1
+            self.sent += 1
+            return data
+
+    def empty(self):
+        with self.cond:
+            return not any(self.order)
+
+    def clear(self):
+        with self.cond:
+            for entries in self.order:
+                entries.clear()
+            self.slots.clear()
+            self.commands = 0
+
+    def stats(self):
+        with self.cond:
+            return {
+                'pending': sum(len(entries) for entries in self.order),
+                'sent': self.sent,
+                'coalesced': sum(self.coalesced.values()),
+                'coalesced_by_channel': dict(self.coalesced),
+                'dropped': self.dropped,
+                'cancelled_drives': self.cancelled_drives,
+                'classes': {
+                    name: dict(pending=len(self.order[level]), sent=self.sent_by_class[level],
+                               **wait_stats(self.waits[level]))
+                    for level, name in enumerate(CLASS_NAMES)
+                },
+            }
+
+
+class LineFramer():
+    """
+    Splits the byte stream from the Arduino into lines. Bytes are collected
+    in one reusable bytearray, complete lines are cut on \r or \n and decoded
+    once (malformed UTF-8 is replaced, not fatal), and empty lines are
+    skipped. A line longer than max_line is dropped up to its end, so a
+    missing terminator cannot make the buffer grow without bound.
+    """
+    def __init__(self, max_line=256):
+        self.max_line = max_line
+        self.buffer = bytearray()
+        self.discarding = False
+        self.overflows = 0
+
+    def feed(self, data):
+        # Returns the complete lines in data (plus what was buffered before)
+        self.buffer += data
+        lines = []
+        start = 0
+        for end in LINE_END.finditer(self.buffer):
+            pos = end.start()
+            if self.discarding:
+                self.discarding = False
+            elif pos > start:
+                lines.append(self.buffer[start:pos].decode('utf-8', errors='replace'))
+            start = pos + 1
+        del self.buffer[:start]
+        if len(self.buffer) > self.max_line:
+            self.buffer.clear()
+            if not self.discarding:
+                self.discarding = True
+                self.overflows += 1
+        return lines
+
+
+class ArduinoLink():
+    """
+    Serial link to the Arduino, run by two threads which block instead of
+    polling. The writer waits on the outbound queue (with a timeout, so it
+    notices stop()) and writes the commands. The reader blocks in the
+    serial read until bytes arrive or the serial timeout passes, drains
+    everything else waiting and hands every complete line to on_line (see
+    LineFramer).
+
+    With protocol "ascii" every command is written as a line, which the
+    Arduino echoes back. With "auto" the writer first sends HELLO, as a
+    frame and as a line, until the sketch answers or negotiate_timeout
+    passes; commands wait (and setpoints coalesce) meanwhile. A sketch
+    which speaks the binary protocol switches to it, an older one is
+    driven with ASCII lines as before. In binary mode the writer packs
+    whatever is waiting, up to MAX_FRAME_COMMANDS, into one frame. At most
+    window frames are unacknowledged at a time, so commands wait in the
+    queue (where setpoints coalesce) rather than in the serial buffers.
+
+    The sketch runs frames once each and in order, and an ACK covers every
+    frame before it. When a frame is rejected (bad checksum, or a gap
+    before it) or not acknowledged within ack_timeout, all unacknowledged
+    frames are sent again under their own sequence numbers; the sketch
+    only acknowledges the ones it has already run. A setpoint which a later
+    frame carries as well is left out of the repeat, so an old value can
+    never follow a newer one (e.g. X50 after X0).
+
+    A sketch which resets (e.g. after a brown-out) is back in ASCII mode.
+    When it prints its startup banner, or max_timeouts ack timeouts pass
+    in a row, the link drops the unacknowledged frames and sends HELLO
+    again; if the sketch does not answer that, the link fails.
+
+    When either side fails the link stops itself and failed is set, so
+    the caller can tear the connection down.
+    """
+    def __init__(self, port, q, on_line, baudrate=115200, timeout=0.1, max_line=256,
+                 serial_factory=None, protocol="ascii", negotiate_timeout=6.0, hello_interval=1.0,
+                 ack_timeout=0.5, window=2, max_timeouts=3):
+        if serial_factory is None:
+            import serial
+            serial_factory = serial.Serial
+        if protocol not in ("ascii", "auto"):
+            raise ValueError("unknown protocol %r" % protocol)
+        if not 0 < window < REPEAT_WINDOW:
+            raise ValueError("window must be between 1 and %d" % (REPEAT_WINDOW - 1))
+        self.serial = serial_factory(port, baudrate, timeout=timeout, write_timeout=1.0)
+        self.q = q
+        self.on_line = on_line
+        self.timeout = timeout
+        self.framer = LineFramer(max_line)
+        self.protocol = protocol
+        self.negotiate_timeout = negotiate_timeout
+        self.hello_interval = hello_interval
+        self.ack_timeout = ack_timeout
+        self.window = window
+        self.max_timeouts = max_timeouts
+        self.timeouts_in_row = 0
+        self.reset_detected = False
+        self.renegotiations = 0
+        self.negotiated = threading.Event()
+        self.binary = False
+        self.sequence = HELLO_SEQUENCE
+        self.reply_marker = None
+        self.setpoints = getattr(q, 'setpoints', SETPOINTS)
+        self.lock = threading.Condition()
+        # sequence -> [time sent, commands, frame number], oldest first
+        self.unacked = OrderedDict()
+        # setpoint channel -> number of the last frame which carried it
+        self.carried = {}
+        self.go_back = False
+        self.stopping = threading.Event()
+        self.failed = False
+        self.written = 0
+        self.received = 0
+        self.frames = 0
+        self.acked = 0
+        self.nacked = 0
+        self.lost = 0
+        self.retransmitted = 0
+        self.bytes_written = 0
+        self.bytes_read = 0
+        self.threads = []
+
+    def start(self):
+        self.serial.reset_input_buffer()
+        if self.protocol == "ascii":
+            self.negotiated.set()
+        self.threads = [threading.Thread(target=self.run_writer, name="Arduino writer", daemon=True),
+                        threading.Thread(target=self.run_reader, name="Arduino reader", daemon=True)]
+        for thread in self.threads:
+            thread.start()
+
+    def stop(self):
+        self.stopping.set()
+
+    def join(self):
+        for thread in self.threads:
+            if thread is not threading.current_thread():
+                thread.join()
+        self.serial.close()
+
+    @property
+    def alive(self):
+        return not self.stopping.is_set()
+
+    @property
+    def mode(self):
+        if not self.negotiated.is_set():
+            return "negotiating"
+        return "binary" if self.binary else "ascii"
+
+    def fail(self, error):
+        print(error)
+        self.failed = True
+        self.stopping.set()
+
+    def stats(self):
+        with self.lock:
+            return {
+                'mode': self.mode,
+                'written': self.written,
+                'received': self.received,
+                'frames': self.frames,
+                'acked': self.acked,
+                'nacked': self.nacked,
+                'lost': self.lost,
+                'retransmitted': self.retransmitted,
+                'renegotiations': self.renegotiations,
+                'unacked': len(self.unacked),
+                'bytes_written': self.bytes_written,
+                'bytes_read': self.bytes_read,
+            }
+
+    def write(self, data):
+        self.serial.write(data)
+        self.bytes_written += len(data)
+
+    def negotiate(self, again=False):
+        # Returns False if the link failed or was stopped meanwhile. Without
+        # an answer the link uses ASCII, or fails when the sketch spoke binary before.
+        deadline = time.monotonic() + self.negotiate_timeout
+        hello = encode_frame(HELLO_SEQUENCE, encode_command(HELLO)) + ('\n' + HELLO + '\n').encode()
+        while not self.negotiated.is_set():
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                if again:
+                    self.fail("Arduino did not answer the protocol request after a reset")
+                    return False
+                print("Arduino did not answer the protocol request; using ASCII")
+                self.negotiated.set()
+                break
+            try:
+                self.write(hello)
+            except Exception as e:
+                self.fail(e)
+                return False
+            self.negotiated.wait(min(self.hello_interval, remaining))
+            if self.stopping.is_set():
+                return False
+        print("Arduino protocol:", self.mode)
+        return True
+
+    def renegotiate(self):
+        # After a reset of the sketch: forget the frames in flight and ask for binary again
+        print("Arduino reset detected; renegotiating the protocol")
+        with self.lock:
+            self.unacked.clear()
+            self.carried.clear()
+            self.go_back = False
+            self.reset_detected = False
+            self.timeouts_in_row = 0
+            self.binary = False
+            self.sequence = HELLO_SEQUENCE
+            self.negotiated.clear()
+            self.renegotiations += 1
+        return self.negotiate(again=True)
+
+    def resolve(self, binary):
+        # Called by the reader with the answer to HELLO
+        if not self.negotiated.is_set():
+            self.binary = binary
+            self.negotiated.set()
+
+    def next_sequence(self):
+        self.sequence = self.sequence % 255 + 1  # 1..255, HELLO_SEQUENCE is only used for HELLO
+        return self.sequence
+
+    def send_frame(self, commands):
+        payload = bytearray()
+        sent = []
+        for data in commands:
+            try:
+                payload += encode_command(data)
+                sent.append(data)
+            except (ValueError, UnicodeEncodeError, struct.error):
+                print("Cannot encode Arduino command:", data)
+        if not sent:
+            return
+        sequence = self.next_sequence()
+        with self.lock:
+            self.frames += 1
+            self.unacked[sequence] = [time.monotonic(), sent, self.frames]
+            for data in sent:
+                if data[:1] in self.setpoints:
+                    self.carried[data[:1]] = self.frames
+        self.write(encode_frame(sequence, payload))
+        self.written += len(sent)
+        print(" ".join(sent))
+
+    def retransmit(self):
+        # Sends every unacknowledged frame again, in order, without stale setpoints
+        now = time.monotonic()
+        with self.lock:
+            self.go_back = False
+            frames = list(self.unacked.items())
+            for sequence, frame in frames:
+                frame[0] = now
+                frame[1] = [data for data in frame[1]
+                            if data[:1] not in self.setpoints or self.carried.get(data[:1], 0) <= frame[2]]
+            self.retransmitted += len(frames)
+        for sequence, frame in frames:
+            self.write(encode_frame(sequence, b"".join(encode_command(data) for data in frame[1])))
+
+    def check_acks(self):
+        # The oldest frame unacknowledged for longer than ack_timeout counts as lost
+        limit = time.monotonic() - self.ack_timeout
+        with self.lock:
+            if self.unacked and next(iter(self.unacked.values()))[0] < limit:
+                self.lost += 1
+                self.go_back = True
+                self.timeouts_in_row += 1
+                if self.timeouts_in_row >= self.max_timeouts:
+                    self.reset_detected = True
+
+    def on_reply(self, marker, sequence):
+        if sequence == HELLO_SEQUENCE:
+            if marker == FRAME_ACK:
+                self.resolve(True)
+            return
+        with self.lock:
+            if sequence not in self.unacked:
+                return
+            if marker == FRAME_ACK:
+                self.timeouts_in_row = 0
+                # frames run in order, so this frame and all before it arrived
+                while self.unacked:
+                    acked, _ = self.unacked.popitem(last=False)
+                    self.acked += 1
+                    if acked == sequence:
+                        break
+            else:
+                self.nacked += 1
+                self.go_back = True
+            self.lock.notify()
+
+    def split_replies(self, data):
+        # Takes the ACK/NACK replies out of data and returns the text around them
+        if self.reply_marker is not None:
+            if not data:
+                return data
+            self.on_reply(self.reply_marker, data[0])
+            self.reply_marker = None
+            data = data[1:]
+        if data.isascii():
+            return data
+        text = bytearray()
+        start = 0
+        for match in FRAME_REPLY.finditer(data):
+            text += data[start:match.start()]
+            start = match.end()
+            if match.group(2):
+                self.on_reply(match.group(1)[0], match.group(2)[0])
+            else:
+                # the sequence number is in the next read
+                self.reply_marker = match.group(1)[0]
+        text += data[start:]
+        return bytes(text)
+
+    def get_commands(self):
+        # The first command waits up to the serial timeout, the rest are taken if already queued
+        commands = [self.q.get(timeout=self.timeout)]
+        while len(commands) < MAX_FRAME_COMMANDS:
+            try:
+                commands.append(self.q.get(timeout=0))
+            except queue.Empty:
+                break
+        return commands
+
+    def run_writer(self):
+        if not self.negotiated.is_set() and not self.negotiate():
+            return
+        while not self.stopping.is_set():
+            if self.binary:
+                self.check_acks()
+                if self.reset_detected:
+                    if not self.renegotiate():
+                        return
+                    continue
+                if self.go_back:
+                    try:
+                        self.retransmit()
+                    except Exception as e:
+                        self.fail(e)
+                        return
+                with self.lock:
+                    ready = self.lock.wait_for(lambda: len(self.unacked) < self.window or self.go_back
+                                               or self.reset_detected, self.timeout)
+                    if not ready or self.go_back or self.reset_detected:
+                        continue
+            try:
+                if self.binary:
+                    commands = self.get_commands()
+                else:
+                    commands = [self.q.get(timeout=self.timeout)]
+            except queue.Empty:
+                continue
+            try:
+                if self.binary:
+                    self.send_frame(commands)
+                else:
+                    self.write((commands[0] + '\n').encode())
+                    self.written += 1
+                    print(commands[0])
+            except Exception as e:
+                self.fail(e)
+                return
+
+    def run_reader(self):
+        while not self.stopping.is_set():
+            try:
+                # blocks for the first byte (up to the serial timeout), then takes whatever else is waiting
+                data = self.serial.read(max(1, self.serial.in_waiting))
+            except Exception as e:
+                self.fail(e)
+                return
+            self.bytes_read += len(data)
+            if self.binary or not self.negotiated.is_set():
+                # replies only exist in binary mode; ASCII text keeps every byte
+                data = self.split_replies(data)
+            for line in self.framer.feed(data):
+                if not self.negotiated.is_set():
+                    # the answer to HELLO: BINARY_READY, or an echo from a sketch without binary support
+                    if line == BINARY_READY or line == HELLO:
+                        self.resolve(line == BINARY_READY)
+                        continue
+                elif line == BINARY_READY:
+                    continue
+                elif line == SKETCH_BANNER and self.binary:
+                    with self.lock:
+                        self.reset_detected = True
+                        self.lock.notify()
+                self.received += 1
+                try:
+                    self.on_line(line)
+                except Exception as e:
+                    # a bad message must not take the link down
+                    print("Arduino message error:", e)
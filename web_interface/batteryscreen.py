@@ -0,0 +1,70 @@
+from collections import OrderedDict
+
+from PIL import Image
+from PIL import ImageDraw
+from PIL import ImageFont
+
+
+class BatteryScreen():
+    """
+    Renders the solar charge level screen for the OLED. The background and
+    fonts are loaded once, rendered frames are memoized by what is actually
+    drawn (label, number of bars, warning), and render() reports whether the
+    result differs from the frame last handed out so callers can skip the
+    display update entirely.
+    """
+    def __init__(self, folder, to_frame, cache_size=32):
+        self.background = Image.open(folder + 'bsun.jpg').convert("RGB")
+        self.fontTitle = ImageFont.truetype(folder + 'cambriab.ttf', 10)
+        self.font = ImageFont.truetype(folder + 'cambriab.ttf', 8)
+        # converts a PIL image to whatever the display wants (e.g. RGB565 words)
+        self.to_frame = to_frame
+        self.cache = OrderedDict()
+        self.cache_size = cache_size
+        self.shown = None
+
+    def bucket(self, batteryLevel):
+        # Everything that influences the rendered pixels, and nothing else
+        level = int(batteryLevel)
+        if level > 110:
+            label = ('Charging ' + str(batteryLevel), "BLUE")
+            level = 100
+        elif level < 0:
+            label = ('ERR:No Con ' + str(batteryLevel), "RED")
+            level = 0
+        else:
+            label = (str(batteryLevel) + '%', "WHITE")
+        bars = min(10, (level + 9) // 10)
+        return label, bars, level < 4
+
+    def draw(self, key):
+        (text, colour), bars, warning = key
+        image = self.background.copy()
+        draw = ImageDraw.Draw(image)
+        draw.text((16, 0), 'SOLAR CHARGE LEVEL', fill = "YELLOW", font = self.fontTitle)
+        draw.text((0, 118), text, fill = colour, font = self.font)
+        for y in range(9, 9 - bars, -1):
+            draw.rectangle([(60, 25+y*10), (120, 34+y*10)], fill = "YELLOW", outline = "BLACK")
+        if warning:
+            draw.rectangle([(60, 116), (120, 127)], fill = "BLACK", outline = "RED")
+            draw.text((64, 116), 'WARNING!', fill = "RED", font = self.fontTitle)
+        return self.to_frame(image)
+
+    def render(self, batteryLevel):
+        # Returns (frame, changed)
+        key = self.bucket(batteryLevel)
+        frame = self.cache.get(key)
+        if frame is None:
+            frame = self.draw(key)
+            self.cache[key] = frame
+            if len(self.cache) > self.cache_size:
+                self.cache.popitem(last=False)
+        else:
+            self.cache.move_to_end(key)
+        changed = key != self.shown
+        self.shown = key
+        return frame, changed
+
+    def invalidate(self):
+        # Something else was drawn on the screen; the next render is shown again
+        self.shown = None
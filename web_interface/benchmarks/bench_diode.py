@@ -0,0 +1,112 @@
+"""
+Diode model benchmark: the LOOKUP_SAMPLES table through Waveshaper (nearest
+bin and linear interpolation) against exact evaluation of the diode curve, on the same synthetic signal that
+robotvoice feeds into the ring modulator (normalized speech plus the
+0.5 gain carrier):
+
+    python3 benchmarks/bench_diode.py [--seconds 1 5 20] [--json results.json]
+
+Reports the time per call, throughput in samples per second and the error
+of the lookup modes relative to the exact mode.
+"""
+import argparse
+import json
+import os
+import sys
+import time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(HERE))
+
+import numpy as np
+
+from ringmod import diode_lookup, diode_pair
+from waveshaper import Waveshaper
+
+# same defaults as app.py
+VB = 0.01
+VL = 0.02
+H = 1
+LOOKUP_SAMPLES = 1024
+MOD_F = 50
+RATE = 24000
+
+
+def ring_input(seconds):
+    rng = np.random.default_rng(3)
+    n = int(seconds * RATE)
+    t = np.arange(n) / RATE
+    # a buzzy 120 Hz voice with a syllable envelope, normalized like robotvoice does
+    voice = np.sign(np.sin(2*np.pi*120*t)) * 0.3 + rng.normal(0, 0.1, n)
+    voice *= 0.5 + 0.5*np.sin(2*np.pi*4*t)**2
+    voice /= np.max(np.abs(voice))
+    return voice + 0.5*np.sin(2*np.pi*MOD_F*t)
+
+
+def timed(function, repeat):
+    best = None
+    for i in range(repeat):
+        start = time.perf_counter()
+        result = function()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return result, best
+
+
+def run(lengths, repeat):
+    results = []
+    start = time.perf_counter()
+    diode_lookup.cache_clear()
+    diode_lookup(LOOKUP_SAMPLES, VB, VL, H)
+    build = time.perf_counter() - start
+    start = time.perf_counter()
+    diode_lookup(LOOKUP_SAMPLES, VB, VL, H)
+    memoized = time.perf_counter() - start
+    print("table build %.1f us, memoized %.2f us" % (build * 1e6, memoized * 1e6))
+
+    table = diode_lookup(LOOKUP_SAMPLES, VB, VL, H)
+    for seconds in lengths:
+        signal = ring_input(seconds).astype(np.float32)
+        exact, exact_time = timed(lambda: diode_pair(signal, VB, VL, H), repeat)
+        # robotvoice rescales the result to its peak, so compare at equal peak level
+        exact_n = exact / np.max(np.abs(exact))
+        entry = {
+            'seconds': seconds,
+            'samples': signal.size,
+            'exact_ms': round(exact_time * 1000, 3),
+            'exact_samples_per_s': round(signal.size / exact_time),
+        }
+        for mode in ("nearest", "linear"):
+            shaper = Waveshaper(table, mode)
+            out = np.empty_like(signal)
+            work = np.empty_like(signal)
+            lookup, lookup_time = timed(lambda: shaper.transform_pair(signal, out, work), repeat)
+            lookup_n = lookup / np.max(np.abs(lookup))
+            entry[mode] = {
+                'ms': round(lookup_time * 1000, 3),
+                'samples_per_s': round(signal.size / lookup_time),
+                'max_abs_error': float(np.max(np.abs(lookup_n - exact_n))),
+                'rms_error': float(np.sqrt(np.mean((lookup_n - exact_n)**2))),
+            }
+        results.append(entry)
+    return {'table_build_us': build * 1e6, 'table_memoized_us': memoized * 1e6, 'runs': results}
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Diode lookup vs exact benchmark")
+    parser.add_argument("--seconds", type=float, nargs="+", default=[1, 5, 20], help="signal lengths")
+    parser.add_argument("--repeat", type=int, default=5, help="best of this many runs")
+    parser.add_argument("--json", help="also write the results to this file")
+    args = parser.parse_args()
+
+    results = run(args.seconds, args.repeat)
+    for r in results['runs']:
+        print("%5.1fs  exact   %8.2f ms (%5.1f Msamples/s)"
+              % (r['seconds'], r['exact_ms'], r['exact_samples_per_s'] / 1e6))
+        for mode in ("nearest", "linear"):
+            m = r[mode]
+            print("        %-7s %8.2f ms (%5.1f Msamples/s)  max err %.5f  rms err %.6f"
+                  % (mode, m['ms'], m['samples_per_s'] / 1e6, m['max_abs_error'], m['rms_error']))
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(results, f, indent=2)
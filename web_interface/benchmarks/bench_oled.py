@@ -0,0 +1,147 @@
+"""
+OLED display throughput benchmarks. Runs the driver against the SSD1351
+emulator, so it works on any Linux box without SPI or GPIO:
+
+    python3 benchmarks/bench_oled.py [--frames 200] [--json results.json]
+
+For every case it reports frames per second through the Python side of the
+driver, bytes / SPI writes / CS transactions per frame, and the frame rate
+the bus itself would allow at the configured SPI clock.
+"""
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+
+os.environ.setdefault("OLED_BACKEND", "emulator")
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(HERE))
+
+import numpy as np
+from PIL import Image, ImageDraw
+
+import OLED_Driver as OLED
+import videocache
+from batteryscreen import BatteryScreen
+from ticker import TextTicker
+
+OLED_FOLDER = os.path.join(os.path.dirname(HERE), "oled") + os.sep
+SOUND_FOLDER = os.path.join(os.path.dirname(HERE), "static", "sounds")
+
+
+def measure(name, frames, step):
+    # step(i) draws frame i; the emulator only counts, so timings are the driver's own
+    backend = OLED.EmulatorBackend(decode=False)
+    OLED.Use_Backend(backend)
+    OLED.Clear_Screen()
+    backend.reset_counters()
+    start = time.perf_counter()
+    for i in range(frames):
+        step(i)
+    elapsed = time.perf_counter() - start
+    counters = backend.counters()
+    bus_seconds = counters['bytes'] * 8.0 / OLED.SPI_SPEED_HZ
+    return {
+        'case': name,
+        'frames': frames,
+        'fps': round(frames / elapsed, 1),
+        'bytes_per_frame': round(counters['bytes'] / frames, 1),
+        'writes_per_frame': round(counters['writes'] / frames, 2),
+        'transactions_per_frame': round(counters['transactions'] / frames, 2),
+        'bus_limited_fps': round(frames / bus_seconds, 1) if bus_seconds else None,
+    }
+
+
+def noise_images(count):
+    rng = np.random.default_rng(1)
+    return [Image.fromarray(rng.integers(0, 256, (OLED.SSD1351_HEIGHT, OLED.SSD1351_WIDTH, 3), dtype=np.uint8))
+            for i in range(count)]
+
+
+def sprite_images(count):
+    # a small square moving over a static background, like a status animation
+    background = Image.open(OLED_FOLDER + 'bsun.jpg').convert("RGB")
+    images = []
+    for i in range(count):
+        image = background.copy()
+        x = (i * 3) % (OLED.SSD1351_WIDTH - 16)
+        ImageDraw.Draw(image).rectangle([(x, 60), (x + 15, 75)], fill="RED")
+        images.append(image)
+    return images
+
+
+def cached_clip(folder):
+    # Transcode a real clip when OpenCV is around, otherwise write a synthetic one
+    path = os.path.join(folder, "bench.rgb565")
+    sources = sorted(f for f in os.listdir(SOUND_FOLDER) if f.endswith(".webm"))
+    try:
+        import cv2
+        if sources:
+            videocache.transcode(os.path.join(SOUND_FOLDER, sources[0]), path)
+            return videocache.CachedClip(path)
+    except ImportError:
+        pass
+    rng = np.random.default_rng(2)
+    count = 120
+    with open(path, 'wb') as out:
+        out.write(videocache.HEADER.pack(videocache.MAGIC, videocache.VERSION, videocache.FRAME_WIDTH,
+                                         videocache.FRAME_HEIGHT, 24.0, count, 0.0).ljust(videocache.HEADER_SIZE, b'\0'))
+        for i in range(count):
+            out.write(rng.integers(0, 65536, videocache.FRAME_BYTES // 2, dtype=np.uint16).tobytes())
+    return videocache.CachedClip(path)
+
+
+def run(frames):
+    results = []
+
+    images = noise_images(min(frames, 50))
+    results.append(measure("display_image_full", frames,
+                           lambda i: OLED.Display_Image(images[i % len(images)], partial=False)))
+    results.append(measure("display_image_legacy", min(frames, 10),
+                           lambda i: OLED.Display_Image_Legacy(images[i % len(images)])))
+
+    sprites = sprite_images(min(frames, 40))
+    results.append(measure("display_image_partial", frames,
+                           lambda i: OLED.Display_Image(sprites[i % len(sprites)])))
+
+    colours = [OLED.RED, OLED.GREEN, OLED.BLUE, OLED.WHITE]
+    results.append(measure("fill_color", frames, lambda i: OLED.Fill_Color(colours[i % len(colours)])))
+
+    screen = BatteryScreen(OLED_FOLDER, OLED.Image_To_RGB565)
+
+    def battery(i):
+        frame, changed = screen.render((i // 4) % 101)
+        if changed:
+            OLED.Display_Frame(frame)
+    results.append(measure("battery_screen", frames, battery))
+
+    # the band is written once, after that the controller does the scrolling
+    ticker = TextTicker(OLED, OLED_FOLDER + 'cambriab.ttf')
+    results.append(measure("ticker", frames, lambda i: ticker.show("IP 192.168.1.10") if i == 0 else None))
+
+    with tempfile.TemporaryDirectory() as folder:
+        clip = cached_clip(folder)
+        results.append(measure("play_movie_cached", min(frames, len(clip)),
+                               lambda i: OLED.Display_Frame(clip.frame(i))))
+        results[-1]['clip_fps'] = round(clip.fps, 1)
+        clip.close()
+
+    return results
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="OLED display throughput benchmarks")
+    parser.add_argument("--frames", type=int, default=200, help="frames per case")
+    parser.add_argument("--json", help="also write the results to this file")
+    args = parser.parse_args()
+
+    results = run(args.frames)
+    for r in results:
+        print("%-24s %8.1f fps  %8.1f B/frame  %6.2f writes  %5.2f transactions  bus limit %s fps"
+              % (r['case'], r['fps'], r['bytes_per_frame'], r['writes_per_frame'],
+                 r['transactions_per_frame'], r['bus_limited_fps']))
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(results, f, indent=2)
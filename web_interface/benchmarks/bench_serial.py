@@ -0,0 +1,494 @@
+"""
+Arduino link benchmark over a pseudo terminal, so no Arduino is needed:
+
+    python3 benchmarks/bench_serial.py [--idle 3] [--commands 200] [--throughput 2000] [--json results.json]
+
+The "legacy" case is the polling loop process_data used to run (queue
+check and inWaiting() in a tight loop); "link" is arduinolink.ArduinoLink.
+For each it reports the CPU time used by the process while the link is
+idle, and the latency of commands (queue to the far end of the pty) and of
+messages from the Arduino (far end to the line callback).
+
+The throughput comparison drives a simulated wall-e.ino (the ASCII parser
+with its echo, and the binary frame parser with its acks) which reads no
+faster than --baud allows. It sends --throughput setpoint commands with
+each protocol and reports the time until all were applied, and the bytes
+on the wire in each direction per command. With --corrupt, that fraction
+of the bytes reaching the Arduino get a bit flipped: ASCII mode then
+applies wrong values, binary mode rejects the frame and sends it again
+(leaving out setpoints which a later frame carries, so "missing" counts
+those too; "stale" counts channels left at a value other than the last).
+
+The priority comparison queues --backlog servo presets and animations,
+then a stop (X0), and times how long the stop takes to reach the
+simulated Arduino: once with the CommandQueue scheduler and once with a
+plain FIFO queue, for each protocol.
+
+The reset check restarts the simulated sketch (back in ASCII mode, deaf
+while it boots) in the middle of a stream of setpoints in binary mode, and
+reports how long the link took to renegotiate and whether any wrong
+command was applied.
+"""
+import argparse
+import collections
+import json
+import os
+import queue
+import random
+import select
+import sys
+import threading
+import time
+import tty
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(HERE))
+
+import numpy as np
+import serial
+
+from arduinolink import (ArduinoLink, CommandQueue, BINARY_READY, FRAME_ACK, FRAME_NACK, FRAME_START,
+                         REPEAT_WINDOW, SKETCH_BANNER, crc8)
+
+
+class LegacyLink():
+    # The loop process_data ran before the link threads, for comparison
+    def __init__(self, port, q, on_line):
+        self.serial = serial.Serial(port, 115200)
+        self.q = q
+        self.on_line = on_line
+        self.lock = threading.Lock()
+        self.exit = False
+        self.thread = threading.Thread(target=self.run, daemon=True)
+
+    def start(self):
+        self.thread.start()
+
+    def stop(self):
+        self.exit = True
+
+    def join(self):
+        self.thread.join()
+        self.serial.close()
+
+    def run(self):
+        dataString = ""
+        while not self.exit:
+            self.lock.acquire()
+            if not self.q.empty():
+                data = self.q.get() + '\n'
+                self.lock.release()
+                self.serial.write(data.encode())
+            else:
+                self.lock.release()
+            if self.serial.inWaiting() > 0:
+                data = self.serial.read().decode()
+                if data == '\n' or data == '\r':
+                    self.on_line(dataString)
+                    dataString = ""
+                else:
+                    dataString += data
+
+
+class SimulatedArduino(threading.Thread):
+    # The serial side of wall-e.ino: readSerial/evaluateSerial and readFrame
+    MAX_SERIAL = 5
+
+    def __init__(self, fd, binary=True, baudrate=115200, corrupt=0.0):
+        threading.Thread.__init__(self, daemon=True)
+        self.fd = fd
+        self.supports_binary = binary
+        self.baudrate = baudrate
+        self.corrupt = corrupt
+        self.random = random.Random(7)
+        self.binary = False
+        self.buffer = b""
+        self.frame = None
+        self.last_sequence = 0
+        self.applied = []
+        self.watch = None
+        self.seen = threading.Event()
+        self.bytes_in = 0
+        self.bytes_out = 0
+        self.last_activity = time.monotonic()
+        self.booting_until = 0.0
+        self.stopping = threading.Event()
+
+    def reset(self, boot=0.5):
+        # Like a brown-out: ASCII mode again, and input is discarded while setup() runs
+        self.binary = False
+        self.buffer = b""
+        self.frame = None
+        self.last_sequence = 0
+        self.booting_until = time.monotonic() + boot
+        self.reply((SKETCH_BANNER + "\r\n").encode())
+
+    def run(self):
+        while not self.stopping.is_set():
+            ready, _, _ = select.select([self.fd], [], [], 0.05)
+            if not ready:
+                continue
+            try:
+                data = os.read(self.fd, 64)
+            except OSError:
+                return
+            self.bytes_in += len(data)
+            if self.baudrate:
+                # 10 bits per byte on the wire
+                time.sleep(len(data) * 10 / self.baudrate)
+            if time.monotonic() < self.booting_until:
+                continue
+            for byte in data:
+                if self.corrupt and self.random.random() < self.corrupt:
+                    byte ^= 1 << self.random.randrange(8)
+                if self.binary:
+                    self.read_frame(byte)
+                else:
+                    self.read_serial(byte)
+            self.last_activity = time.monotonic()
+
+    def reply(self, data):
+        os.write(self.fd, data)
+        self.bytes_out += len(data)
+
+    def read_serial(self, byte):
+        if byte in b"\r\n":
+            if self.buffer:
+                self.evaluate_serial()
+            self.buffer = b""
+        else:
+            self.buffer += bytes((byte,))
+            if len(self.buffer) == self.MAX_SERIAL:
+                self.evaluate_serial()
+                self.buffer = b""
+
+    def evaluate_serial(self):
+        command = chr(self.buffer[0])
+        digits = self.buffer[1:].decode('ascii', errors='replace')
+        number = 0
+        for end in range(len(digits), 0, -1):
+            try:
+                number = int(digits[:end])  # atoi: the longest leading number
+                break
+            except ValueError:
+                pass
+        if command == 'P' and self.supports_binary:
+            if number == 1:
+                self.reply((BINARY_READY + "\r\n").encode())
+            self.evaluate(command, number)
+            return
+        self.reply(b"%s%d\r\n" % (command.encode('latin-1'), number))
+        self.evaluate(command, number)
+
+    def read_frame(self, byte):
+        if self.frame is None:
+            if byte == FRAME_START:
+                self.frame = bytearray()
+            return
+        self.frame.append(byte)
+        if len(self.frame) == 2 and (byte > 30 or byte % 3):
+            self.frame = None
+        elif len(self.frame) >= 2 and len(self.frame) == self.frame[1] + 3:
+            frame, self.frame = self.frame, None
+            sequence = frame[0]
+            if crc8(frame[:-1]) != frame[-1]:
+                self.reply(bytes((FRAME_NACK, sequence)))
+                return
+            if sequence != 0:
+                if (self.last_sequence - sequence) % 255 < REPEAT_WINDOW:
+                    self.reply(bytes((FRAME_ACK, sequence)))
+                    return
+                if sequence != self.last_sequence % 255 + 1:
+                    self.reply(bytes((FRAME_NACK, sequence)))
+                    return
+                self.last_sequence = sequence
+            self.reply(bytes((FRAME_ACK, sequence)))
+            for i in range(2, len(frame) - 1, 3):
+                number = int.from_bytes(frame[i+1:i+3], 'little', signed=True)
+                self.evaluate(chr(frame[i]), number)
+
+    def evaluate(self, command, number):
+        if command == 'P':
+            self.binary = number == 1 and self.supports_binary
+            self.last_sequence = 0
+        else:
+            self.applied.append("%s%d" % (command, number))
+            if self.applied[-1] == self.watch:
+                self.seen.set()
+
+
+def open_pty():
+    master, slave = os.openpty()
+    tty.setraw(master)
+    tty.setraw(slave)
+    return master, os.ttyname(slave), slave
+
+
+def read_line(fd, timeout=2.0):
+    data = b""
+    deadline = time.monotonic() + timeout
+    while not data.endswith(b"\n"):
+        ready, _, _ = select.select([fd], [], [], max(0, deadline - time.monotonic()))
+        if not ready:
+            raise TimeoutError("no command arrived")
+        data += os.read(fd, 1024)
+    return data
+
+
+def percentiles(samples):
+    ms = np.array(samples) * 1000.0
+    return {
+        'mean_ms': round(float(ms.mean()), 3),
+        'p50_ms': round(float(np.percentile(ms, 50)), 3),
+        'p95_ms': round(float(np.percentile(ms, 95)), 3),
+        'max_ms': round(float(ms.max()), 3),
+    }
+
+
+def run_case(kind, idle_seconds, commands):
+    master, port, slave = open_pty()
+    q = queue.Queue()
+    lines = queue.Queue()
+    on_line = lambda line: lines.put((time.perf_counter(), line))
+    if kind == "legacy":
+        link = LegacyLink(port, q, on_line)
+    else:
+        link = ArduinoLink(port, q, on_line)
+    link.start()
+    try:
+        time.sleep(0.2)
+        cpu = time.process_time()
+        wall = time.perf_counter()
+        time.sleep(idle_seconds)
+        idle_cpu = (time.process_time() - cpu) / (time.perf_counter() - wall)
+
+        outbound = []
+        for i in range(commands):
+            start = time.perf_counter()
+            q.put("X%d" % i)
+            read_line(master)
+            outbound.append(time.perf_counter() - start)
+            time.sleep(0.002)
+
+        inbound = []
+        for i in range(commands):
+            start = time.perf_counter()
+            os.write(master, b"Battery_%d\n" % (i % 100))
+            arrived, line = lines.get(timeout=2.0)
+            inbound.append(arrived - start)
+            time.sleep(0.002)
+    finally:
+        link.stop()
+        link.join()
+        os.close(master)
+        os.close(slave)
+    return {
+        'idle_cpu_percent': round(idle_cpu * 100, 2),
+        'command_latency': percentiles(outbound),
+        'message_latency': percentiles(inbound),
+    }
+
+
+def run_throughput(protocol, commands, baudrate, corrupt):
+    master, port, slave = open_pty()
+    arduino = SimulatedArduino(master, binary=True, baudrate=baudrate, corrupt=corrupt)
+    arduino.start()
+    q = queue.Queue()
+    link = ArduinoLink(port, q, lambda line: None, protocol="auto" if protocol == "binary" else "ascii")
+    link.start()
+    try:
+        if not link.negotiated.wait(5.0):
+            raise TimeoutError("no protocol answer")
+        if link.binary != (protocol == "binary"):
+            raise RuntimeError("negotiated %s instead of %s" % (link.mode, protocol))
+        time.sleep(0.1)
+        applied_before = len(arduino.applied)
+        bytes_in, bytes_out = arduino.bytes_in, arduino.bytes_out
+        sent = ["%s%d" % ("XYLRBTGEUJK"[i % 11], i % 101) for i in range(commands)]
+        arduino.last_activity = time.monotonic()
+        start = time.perf_counter()
+        for data in sent:
+            q.put(data)
+        # done when everything arrived, or nothing has happened for a while
+        while len(arduino.applied) - applied_before < commands:
+            idle = time.monotonic() - arduino.last_activity
+            if q.empty() and not link.unacked and idle > 0.1:
+                break
+            time.sleep(0.001)
+        elapsed = time.perf_counter() - start
+    finally:
+        link.stop()
+        link.join()
+        arduino.stopping.set()
+        arduino.join()
+        os.close(master)
+        os.close(slave)
+    applied = collections.Counter(arduino.applied[applied_before:])
+    expected = collections.Counter(sent)
+    final = {data[:1]: data for data in arduino.applied[applied_before:]}
+    last = {data[:1]: data for data in sent}
+    stats = link.stats()
+    return {
+        'commands': commands,
+        'seconds': round(elapsed, 3),
+        'commands_per_s': round(commands / elapsed),
+        'bytes_to_arduino_per_command': round((arduino.bytes_in - bytes_in) / commands, 2),
+        'bytes_from_arduino_per_command': round((arduino.bytes_out - bytes_out) / commands, 2),
+        'missing': sum((expected - applied).values()),
+        'wrong': sum((applied - expected).values()),
+        'stale': sum(final.get(channel) != data for channel, data in last.items()),
+        'frames': stats['frames'],
+        'nacked': stats['nacked'],
+        'lost': stats['lost'],
+    }
+
+
+def run_priority(protocol, scheduler, trials, backlog, baudrate):
+    master, port, slave = open_pty()
+    arduino = SimulatedArduino(master, binary=True, baudrate=baudrate)
+    arduino.start()
+    q = CommandQueue(max_commands=backlog) if scheduler == "priority" else queue.Queue()
+    link = ArduinoLink(port, q, lambda line: None, protocol="auto" if protocol == "binary" else "ascii")
+    link.start()
+    latencies = []
+    try:
+        if not link.negotiated.wait(5.0):
+            raise TimeoutError("no protocol answer")
+        presets = "jlikrtyufghbnm"
+        for trial in range(trials):
+            arduino.watch = "X0"
+            arduino.seen.clear()
+            for i in range(backlog):
+                q.put("A%d" % (i % 8) if i % 4 == 0 else presets[i % len(presets)])
+            start = time.perf_counter()
+            q.put("X0")
+            if not arduino.seen.wait(10.0):
+                raise TimeoutError("the stop did not arrive")
+            latencies.append(time.perf_counter() - start)
+            # let the backlog drain before the next trial
+            while not q.empty() or link.unacked or time.monotonic() - arduino.last_activity < 0.05:
+                time.sleep(0.005)
+    finally:
+        link.stop()
+        link.join()
+        arduino.stopping.set()
+        arduino.join()
+        os.close(master)
+        os.close(slave)
+    result = {'stop_latency': percentiles(latencies)}
+    if scheduler == "priority":
+        result['classes'] = q.stats()['classes']
+    return result
+
+
+def run_reset(boot, baudrate):
+    master, port, slave = open_pty()
+    arduino = SimulatedArduino(master, binary=True, baudrate=baudrate)
+    arduino.start()
+    q = CommandQueue()
+    link = ArduinoLink(port, q, lambda line: None, protocol="auto")
+    link.start()
+    sent = []
+    try:
+        if not link.negotiated.wait(5.0) or not link.binary:
+            raise RuntimeError("binary mode was not negotiated")
+        recovered = None
+        for i in range(300):
+            if i == 50:
+                arduino.reset(boot)
+                reset_at = time.perf_counter()
+            elif i > 50 and recovered is None and link.renegotiations and link.binary:
+                recovered = time.perf_counter() - reset_at
+            sent.append("X%d" % (i % 100))
+            q.put(sent[-1])
+            time.sleep(0.01)
+        time.sleep(0.5)
+    finally:
+        link.stop()
+        link.join()
+        arduino.stopping.set()
+        arduino.join()
+        os.close(master)
+        os.close(slave)
+    applied = [data for data in arduino.applied if data[:1] == "X"]
+    return {
+        'recovered_ms': round(recovered * 1000, 1) if recovered is not None else None,
+        'renegotiations': link.renegotiations,
+        'failed': link.failed,
+        # the HELLO frame read as ASCII starts with bytes no command uses; only letters count
+        'wrong': sum(data not in sent for data in arduino.applied
+                     if data[:1].isascii() and data[:1].isalpha() and data[:1] != "P"),
+        'final_ok': bool(applied) and applied[-1] == sent[-1],
+    }
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Arduino serial link benchmark")
+    parser.add_argument("--idle", type=float, default=3.0, help="seconds to measure idle CPU")
+    parser.add_argument("--commands", type=int, default=200, help="commands and messages to time")
+    parser.add_argument("--cases", nargs="+", default=["legacy", "link"], choices=["legacy", "link"])
+    parser.add_argument("--throughput", type=int, default=2000, help="commands for the protocol comparison (0 skips it)")
+    parser.add_argument("--baud", type=int, default=115200, help="simulated serial speed (0 for unlimited)")
+    parser.add_argument("--corrupt", type=float, default=0.0, help="fraction of bytes to corrupt on the way in")
+    parser.add_argument("--backlog", type=int, default=60, help="queued commands ahead of the stop (0 skips the priority comparison)")
+    parser.add_argument("--trials", type=int, default=20, help="stops to time per priority case")
+    parser.add_argument("--boot", type=float, default=0.5, help="seconds the simulated sketch takes to restart (reset check)")
+    parser.add_argument("--json", help="also write the results to this file")
+    args = parser.parse_args()
+
+    # the link prints every command it sends; keep the report readable
+    results = {}
+    for kind in args.cases:
+        stdout = sys.stdout
+        sys.stdout = open(os.devnull, 'w')
+        try:
+            results[kind] = run_case(kind, args.idle, args.commands)
+        finally:
+            sys.stdout.close()
+            sys.stdout = stdout
+        r = results[kind]
+        print("%-7s idle CPU %6.2f%%  command p50 %.3f ms p95 %.3f ms  message p50 %.3f ms p95 %.3f ms"
+              % (kind, r['idle_cpu_percent'], r['command_latency']['p50_ms'], r['command_latency']['p95_ms'],
+                 r['message_latency']['p50_ms'], r['message_latency']['p95_ms']))
+    if args.throughput:
+        results['throughput'] = {}
+        for protocol in ("ascii", "binary"):
+            stdout = sys.stdout
+            sys.stdout = open(os.devnull, 'w')
+            try:
+                r = run_throughput(protocol, args.throughput, args.baud, args.corrupt)
+            finally:
+                sys.stdout.close()
+                sys.stdout = stdout
+            results['throughput'][protocol] = r
+            print("%-7s %d commands in %.3f s (%d/s)  bytes per command: %.2f out, %.2f back  "
+                  "missing %d wrong %d stale %d  nacked %d lost %d"
+                  % (protocol, r['commands'], r['seconds'], r['commands_per_s'],
+                     r['bytes_to_arduino_per_command'], r['bytes_from_arduino_per_command'],
+                     r['missing'], r['wrong'], r['stale'], r['nacked'], r['lost']))
+    if args.backlog:
+        results['priority'] = {}
+        for protocol in ("ascii", "binary"):
+            for scheduler in ("fifo", "priority"):
+                stdout = sys.stdout
+                sys.stdout = open(os.devnull, 'w')
+                try:
+                    r = run_priority(protocol, scheduler, args.trials, args.backlog, args.baud)
+                finally:
+                    sys.stdout.close()
+                    sys.stdout = stdout
+                results['priority']["%s_%s" % (protocol, scheduler)] = r
+                print("%-7s %-8s stop behind %d commands: p50 %.3f ms p95 %.3f ms"
+                      % (protocol, scheduler, args.backlog, r['stop_latency']['p50_ms'], r['stop_latency']['p95_ms']))
+    stdout = sys.stdout
+    sys.stdout = open(os.devnull, 'w')
+    try:
+        r = results['reset'] = run_reset(args.boot, args.baud)
+    finally:
+        sys.stdout.close()
+        sys.stdout = stdout
+    print("reset   renegotiated in %s ms (%d times)  failed %s  wrong %d  final value %s"
+          % (r['recovered_ms'], r['renegotiations'], r['failed'], r['wrong'], "ok" if r['final_ok'] else "stale"))
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(results, f, indent=2)
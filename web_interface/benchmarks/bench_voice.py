@@ -0,0 +1,164 @@
+"""
+Robot voice pipeline benchmark. Runs the stages of robotvoice on synthetic
+speech-like input of several lengths, with gTTS replaced by a local
+stand-in backend behind the same TTSRouter:
+
+    python3 benchmarks/bench_voice.py [--seconds 1 5 20] [--json results.json]
+
+Stages: synthesis (stand-in through the router), mp3 decode (only when
+ffmpeg is installed), diode table build, one-shot and streaming ring
+modulation (ringmod.robotvoice_samples and robotvoice_blocks, as used by
+app.py), mixer channel layout, and phrase cache
+put / memory hit / disk hit. Reports the wall time of every stage (best of
+--repeat), throughput in samples per second and the peak of traced Python
+and NumPy allocations.
+"""
+import argparse
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(HERE))
+
+import numpy as np
+
+from ringmod import diode_lookup, robotvoice_blocks, robotvoice_samples
+from ttsbackend import TTSRouter, ffmpeg_pcm
+from ttscache import PhraseCache, phrase_key
+from waveshaper import Waveshaper
+
+# same defaults as app.py
+VB = 0.01
+VL = 0.02
+H = 1
+LOOKUP_SAMPLES = 1024
+MOD_F = 50
+STREAM_BLOCK = 4096
+RATE = 44100
+
+
+def speech(seconds, rate):
+    # A buzzy voice with a wandering pitch, syllable envelope and pauses, as int16
+    rng = np.random.default_rng(7)
+    n = int(seconds * rate)
+    t = np.arange(n) / rate
+    pitch = 120 + 20*np.sin(2*np.pi*0.7*t)
+    phase = 2*np.pi*np.cumsum(pitch) / rate
+    voice = np.sign(np.sin(phase)) * 0.3 + np.sin(3*phase) * 0.2 + rng.normal(0, 0.05, n)
+    voice *= np.clip(np.sin(2*np.pi*3*t), 0, None)**2
+    return (voice / np.max(np.abs(voice)) * 20000).astype(np.int16)
+
+
+class StandInBackend():
+    # Takes the place of gTTS: hands out prepared PCM in blocks
+    name = "standin"
+
+    def __init__(self, pcm):
+        self.pcm = pcm
+
+    def available(self):
+        return True
+
+    def stream(self, lang, text, rate, block_size):
+        for i in range(0, self.pcm.size, block_size):
+            yield self.pcm[i:i+block_size]
+
+
+def encode_mp3(pcm, rate):
+    proc = subprocess.run(["ffmpeg", "-loglevel", "error", "-f", "s16le", "-ar", str(rate), "-ac", "1",
+                           "-i", "pipe:0", "-f", "mp3", "pipe:1"],
+                          input=pcm.tobytes(), stdout=subprocess.PIPE, check=True)
+    return proc.stdout
+
+
+def blocks(pcm):
+    # The PCM as a backend hands it out
+    return (pcm[i:i+STREAM_BLOCK] for i in range(0, pcm.size, STREAM_BLOCK))
+
+
+def measure(function, repeat):
+    # (result, best wall time, traced peak bytes); the peak comes from a separate run
+    best = None
+    for i in range(repeat):
+        start = time.perf_counter()
+        result = function()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    tracemalloc.start()
+    function()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return result, best, peak
+
+
+def run(lengths, repeat, rate):
+    results = []
+    have_ffmpeg = shutil.which("ffmpeg") is not None
+    if not have_ffmpeg:
+        print("ffmpeg not found: skipping the mp3 decode stage")
+    pair = Waveshaper(diode_lookup(LOOKUP_SAMPLES, VB, VL, H)).transform_pair
+    for seconds in lengths:
+        pcm = speech(seconds, rate)
+        stages = {}
+
+        def stage(name, function, samples=pcm.size):
+            result, elapsed, peak = measure(function, repeat)
+            stages[name] = {
+                'ms': round(elapsed * 1000, 3),
+                'samples_per_s': round(samples / elapsed) if elapsed > 0 else None,
+                'peak_kib': round(peak / 1024, 1),
+            }
+            return result
+
+        router = TTSRouter([StandInBackend(pcm)], "standin")
+        stage('synthesis', lambda: np.concatenate(list(router.open("en", "", rate, STREAM_BLOCK)[1])))
+        if have_ffmpeg:
+            mp3 = encode_mp3(pcm, rate)
+            stage('decode', lambda: np.concatenate(list(ffmpeg_pcm([mp3], rate, STREAM_BLOCK))))
+
+        def build_table():
+            diode_lookup.cache_clear()
+            return diode_lookup(LOOKUP_SAMPLES, VB, VL, H)
+        stage('diode_table', build_table, LOOKUP_SAMPLES)
+        robot = stage('modulate_oneshot', lambda: robotvoice_samples(blocks(pcm), rate, MOD_F, pair))
+        stage('modulate_stream', lambda: np.concatenate(list(robotvoice_blocks(blocks(pcm), rate, MOD_F, pair))))
+        stage('mixer_layout', lambda: np.repeat(robot[:, np.newaxis], 2, axis=1))
+
+        folder = tempfile.mkdtemp(prefix="bench_voice_")
+        try:
+            key = phrase_key("en", seconds)
+            cache = PhraseCache(folder)
+            stage('cache_put', lambda: cache.put(key, robot))
+            stage('cache_memory_hit', lambda: cache.get(key))
+            disk = PhraseCache(folder, memory_bytes=0)
+            stage('cache_disk_hit', lambda: disk.get(key))
+        finally:
+            shutil.rmtree(folder)
+
+        results.append({'seconds': seconds, 'samples': pcm.size, 'stages': stages})
+    return {'rate': rate, 'block': STREAM_BLOCK, 'repeat': repeat, 'runs': results}
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Robot voice pipeline benchmark")
+    parser.add_argument("--seconds", type=float, nargs="+", default=[1, 5, 20], help="speech lengths")
+    parser.add_argument("--repeat", type=int, default=5, help="best of this many runs")
+    parser.add_argument("--rate", type=int, default=RATE, help="sample rate (the mixer rate)")
+    parser.add_argument("--json", help="also write the results to this file")
+    args = parser.parse_args()
+
+    results = run(args.seconds, args.repeat, args.rate)
+    for r in results['runs']:
+        print("%5.1fs of speech (%d samples)" % (r['seconds'], r['samples']))
+        for name, s in r['stages'].items():
+            rate = "%7.1f Msamples/s" % (s['samples_per_s'] / 1e6) if s['samples_per_s'] else ""
+            print("    %-18s %9.3f ms  %s  peak %9.1f KiB" % (name, s['ms'], rate, s['peak_kib']))
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(results, f, indent=2)
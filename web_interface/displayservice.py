@@ -0,0 +1,215 @@
+import itertools
+import threading
+import time
+from collections import deque
+
+PRIORITY_STATUS = 10
+PRIORITY_VIDEO = 20
+WRITE_HISTORY = 256
+
+
+class DisplayToken():
+    """
+    Handle given to a producer of frames. Frames submitted with a token end
+    up in that token's layer; once the token is cancelled (e.g. because a
+    newer video preempted it) further submits are refused.
+    """
+    def __init__(self, priority, name, order):
+        self.priority = priority
+        self.name = name
+        self.order = order
+        self.event = threading.Event()
+
+    @property
+    def cancelled(self):
+        return self.event.is_set()
+
+    def cancel(self):
+        self.event.set()
+
+
+class DisplayService(threading.Thread):
+    """
+    The only thread which talks to the OLED driver. Producers acquire a
+    token, submit frames to it and release it when they are done. Each
+    token holds just its latest frame; the service shows the frame of the
+    highest priority layer (newest first on ties) at no more than max_fps,
+    so frames superseded before they could be presented are dropped. A
+    token acquired with preempt takes over the screen with its first frame:
+    until then the last frame of the layer it cancelled stays on screen. The
+    time each frame takes to convert and write to the OLED is recorded (the
+    last WRITE_HISTORY frames) and reported by stats().
+
+    A ticker (see ticker.TextTicker) can be laid over layers up to a given
+    priority; it is started on the controller after every frame it covers
+    and suspended while a higher priority layer is on screen.
+    """
+    def __init__(self, oled, max_fps=30):
+        threading.Thread.__init__(self, daemon=True)
+        self.name = "Display"
+        self.oled = oled
+        self.min_interval = 1.0 / max_fps
+        self.cond = threading.Condition()
+        self.layers = {}
+        self.fresh = set()
+        self.handover = {}
+        self.calls = []
+        self.dirty = False
+        self.stopping = False
+        self.counter = itertools.count()
+        self.shown = None
+        self.ticker = None
+        self.ticker_changed = False
+        self.ticker_running = False
+        self.submitted = 0
+        self.presented = 0
+        self.dropped = 0
+        self.write_times = deque(maxlen=WRITE_HISTORY)
+
+    def acquire(self, priority, name="", preempt=False):
+        # With preempt, every other layer of the same priority is cancelled;
+        # the newest one with a frame stands in until the token submits its own
+        token = DisplayToken(priority, name, next(self.counter))
+        with self.cond:
+            if preempt:
+                others = [t for t in self.layers if t.priority == priority]
+                visible = [t for t in others if self.layers[t] is not None]
+                standin = max(visible, key=lambda t: t.order) if visible else None
+                for new, old in list(self.handover.items()):
+                    if old is standin:
+                        del self.handover[new]
+                for other in others:
+                    other.cancel()
+                    if other is not standin:
+                        self._remove(other)
+                if standin is not None:
+                    self.handover[token] = standin
+            self.layers[token] = None
+            self.dirty = True
+            self.cond.notify()
+        return token
+
+    def release(self, token):
+        with self.cond:
+            if token in self.handover.values():
+                # still standing in for the token which preempted it
+                return
+            self._remove(token)
+            self.dirty = True
+            self.cond.notify()
+
+    def _remove(self, token):
+        self.layers.pop(token, None)
+        standin = self.handover.pop(token, None)
+        if standin is not None:
+            self._remove(standin)
+        if token in self.fresh:
+            self.fresh.discard(token)
+            self.dropped += 1
+
+    def submit(self, token, frame):
+        # frame is a HxW array of RGB565 words; returns False once cancelled
+        with self.cond:
+            if token.cancelled or token not in self.layers:
+                return False
+            if token in self.fresh:
+                self.dropped += 1
+            if token in self.handover:
+                self._remove(self.handover.pop(token))
+            self.layers[token] = frame
+            self.fresh.add(token)
+            self.submitted += 1
+            self.dirty = True
+            self.cond.notify()
+        return True
+
+    def call(self, function):
+        # Run a driver operation on the display thread, between two frames
+        with self.cond:
+            self.calls.append(function)
+            self.cond.notify()
+
+    def show_ticker(self, ticker, text, priority=PRIORITY_STATUS):
+        with self.cond:
+            self.ticker = (ticker, text, priority)
+            self.ticker_changed = True
+            self.cond.notify()
+
+    def hide_ticker(self):
+        with self.cond:
+            if self.ticker is not None:
+                self.ticker = None
+                self.ticker_changed = True
+                self.cond.notify()
+
+    def active(self, priority):
+        with self.cond:
+            return any(t.priority == priority and not t.cancelled for t in self.layers)
+
+    def stats(self):
+        with self.cond:
+            writes = sorted(self.write_times)
+            return {
+                'submitted': self.submitted,
+                'presented': self.presented,
+                'dropped': self.dropped,
+                'mean_write_ms': round(sum(writes) / len(writes) * 1000, 2) if writes else 0.0,
+                'p95_write_ms': round(writes[int(0.95 * (len(writes) - 1))] * 1000, 2) if writes else 0.0,
+            }
+
+    def stop(self):
+        with self.cond:
+            self.stopping = True
+            self.cond.notify()
+
+    def top(self):
+        visible = [t for t, frame in self.layers.items() if frame is not None]
+        if not visible:
+            return None
+        return max(visible, key=lambda t: (t.priority, t.order))
+
+    def run(self):
+        last = 0
+        while True:
+            with self.cond:
+                while not (self.dirty or self.calls or self.ticker_changed or self.stopping):
+                    self.cond.wait()
+                if self.stopping:
+                    return
+            # producers may keep replacing frames while we wait out the rate cap
+            delay = last + self.min_interval - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+            with self.cond:
+                calls, self.calls = self.calls, []
+                token = self.top()
+                frame = self.layers[token] if token is not None else None
+                self.fresh.discard(token)
+                self.dirty = False
+                ticker, ticker_changed = self.ticker, self.ticker_changed
+                self.ticker_changed = False
+            try:
+                for function in calls:
+                    function()
+                covered = ticker is not None and (token is None or token.priority <= ticker[2])
+                if ticker_changed and self.ticker_running and not covered:
+                    # the old ticker band is still on screen: redraw the frame below it
+                    self.oled.Stop_Scroll()
+                    self.ticker_running = False
+                    self.shown = None
+                # keep a reference to what is shown so identity checks stay valid
+                if frame is not None and (self.shown is None or self.shown[0] is not token or self.shown[1] is not frame):
+                    # a new frame stops any controller scroll before it is written
+                    start = time.monotonic()
+                    self.oled.Display_Frame(frame)
+                    last = time.monotonic()
+                    self.shown = (token, frame)
+                    self.ticker_running = False
+                    with self.cond:
+                        self.presented += 1
+                        self.write_times.append(last - start)
+                if covered and (ticker_changed or not self.ticker_running):
+                    ticker[0].show(ticker[1])
+                    self.ticker_running = True
+            except Exception as e:
+                print("Display error:", e)
@@ -0,0 +1,87 @@
+import time
+
+import numpy as np
+
+
+class MusicClock():
+    """
+    Playback position in seconds, taken from pygame.mixer.music while the
+    track is playing so that video follows the audio. Falls back to the
+    wall clock when no music is playing (get_pos() returns -1).
+    """
+    def __init__(self, music=None):
+        self.music = music
+        self.start = time.monotonic()
+
+    def __call__(self):
+        if self.music is not None:
+            pos = self.music.get_pos()
+            if pos >= 0:
+                return pos / 1000.0
+        return time.monotonic() - self.start
+
+
+class PlaybackStats():
+    def __init__(self):
+        self.shown = 0
+        self.dropped = 0
+        self.late = 0
+        self.costs = []
+
+    def summary(self):
+        costs = np.array(self.costs) * 1000.0
+        return {
+            'shown': self.shown,
+            'dropped': self.dropped,
+            'late': self.late,
+            'mean_cost_ms': round(float(costs.mean()), 2) if costs.size else 0.0,
+            'p95_cost_ms': round(float(np.percentile(costs, 95)), 2) if costs.size else 0.0,
+        }
+
+
+class FramePacer():
+    """
+    Schedules the frames of a clip against its native timestamps
+    (index / fps) on the given clock. Iterating yields the index of the next
+    frame to present, sleeping until it is due. When playback has fallen
+    behind, frames whose time slot has already passed are skipped and
+    counted as dropped, so the caller never decodes them. The time the
+    caller spends between two yields is recorded as the frame cost; that
+    is decoding and handing the frame over, the OLED write itself happens
+    on the display thread (see DisplayService.stats).
+    """
+    def __init__(self, fps, frame_count=None, clock=None, late_tolerance=0.5):
+        self.fps = fps
+        self.frame_count = frame_count
+        self.clock = clock or MusicClock()
+        # a frame counts as late when shown this many frame periods after its timestamp
+        self.late_tolerance = late_tolerance
+        self.stats = PlaybackStats()
+        self.stopped = False
+
+    def stop(self):
+        self.stopped = True
+
+    def __iter__(self):
+        index = 0
+        while not self.stopped and (self.frame_count is None or index < self.frame_count):
+            now = self.clock()
+            due = int(now * self.fps)
+            if due > index:
+                # behind schedule: skip straight to the frame that is due now
+                if self.frame_count is not None:
+                    due = min(due, self.frame_count)
+                self.stats.dropped += due - index
+                index = due
+                continue
+            wait = index / self.fps - now
+            if wait > 0:
+                time.sleep(wait)
+            elif -wait > self.late_tolerance / self.fps:
+                self.stats.late += 1
+
+            start = time.monotonic()
+            yield index
+            self.stats.costs.append(time.monotonic() - start)
+            self.stats.shown += 1
+            index += 1
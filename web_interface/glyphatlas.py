@@ -0,0 +1,110 @@
+import functools
+import string
+from collections import OrderedDict
+
+import numpy as np
+from PIL import Image
+from PIL import ImageColor
+from PIL import ImageDraw
+from PIL import ImageFont
+
+
+class GlyphAtlas():
+    """
+    Glyphs of one font at one size, rasterized once by FreeType into alpha
+    masks. Printable ASCII is prepared up front, anything else on first use
+    and kept in an LRU. draw_text() blends strings straight into a NumPy
+    RGB565 framebuffer, so labels and counters never go back through PIL;
+    the assembled masks of recently drawn strings are cached as well.
+    """
+    def __init__(self, font_path, size, preload=string.printable, cache_size=512, string_cache_size=64):
+        self.font = ImageFont.truetype(font_path, size)
+        self.ascent, self.descent = self.font.getmetrics()
+        self.cache_size = cache_size
+        self.string_cache_size = string_cache_size
+        self.glyphs = OrderedDict()
+        self.strings = OrderedDict()
+        for char in preload:
+            self.glyph(char)
+
+    def glyph(self, char):
+        # (alpha mask as float32 0..1, x offset, y offset, advance)
+        glyph = self.glyphs.get(char)
+        if glyph is not None:
+            self.glyphs.move_to_end(char)
+            return glyph
+        left, top, right, bottom = self.font.getbbox(char)
+        mask = Image.new("L", (max(1, right - left), max(1, bottom - top)), 0)
+        ImageDraw.Draw(mask).text((-left, -top), char, fill = 255, font = self.font)
+        glyph = (np.asarray(mask, dtype=np.float32) / 255.0, left, top, self.font.getlength(char))
+        self.glyphs[char] = glyph
+        if len(self.glyphs) > self.cache_size:
+            self.glyphs.popitem(last=False)
+        return glyph
+
+    def width(self, text):
+        return int(round(sum(self.glyph(char)[3] for char in text)))
+
+    def mask(self, text):
+        # Alpha mask of a whole string and its offset from the pen origin,
+        # assembled from the glyph masks (and kept in a small LRU of its own)
+        entry = self.strings.get(text)
+        if entry is not None:
+            self.strings.move_to_end(text)
+            return entry
+        placed = []
+        pen = 0.0
+        for char in text:
+            alpha, left, top, advance = self.glyph(char)
+            placed.append((alpha, int(round(pen)) + left, top))
+            pen += advance
+        if not placed:
+            entry = (np.zeros((0, 0), dtype=np.float32), 0, 0)
+        else:
+            x0 = min(x for alpha, x, y in placed)
+            y0 = min(y for alpha, x, y in placed)
+            x1 = max(x + alpha.shape[1] for alpha, x, y in placed)
+            y1 = max(y + alpha.shape[0] for alpha, x, y in placed)
+            strip = np.zeros((y1 - y0, x1 - x0), dtype=np.float32)
+            for alpha, x, y in placed:
+                region = strip[y-y0:y-y0+alpha.shape[0], x-x0:x-x0+alpha.shape[1]]
+                np.maximum(region, alpha, out=region)
+            entry = (strip, x0, y0)
+        self.strings[text] = entry
+        if len(self.strings) > self.string_cache_size:
+            self.strings.popitem(last=False)
+        return entry
+
+    def draw_text(self, frame, xy, text, colour):
+        # frame: HxW uint16 RGB565 array, modified in place. colour is a PIL
+        # colour name or RGB tuple, alpha-blended over the frame.
+        if isinstance(colour, str):
+            colour = ImageColor.getrgb(colour)
+        colour = np.asarray(colour[:3], dtype=np.float32)
+        alpha, left, top = self.mask(text)
+        x0 = xy[0] + left
+        y0 = xy[1] + top
+        height, width = frame.shape
+        # clip the string against the frame
+        ax0, ay0 = max(0, -x0), max(0, -y0)
+        ax1 = min(alpha.shape[1], width - x0)
+        ay1 = min(alpha.shape[0], height - y0)
+        if ax1 <= ax0 or ay1 <= ay0:
+            return frame
+        a = alpha[ay0:ay1, ax0:ax1]
+        region = frame[y0+ay0:y0+ay1, x0+ax0:x0+ax1]
+        # unpack to 8 bit channels, blend, and pack again
+        r = ((region >> 11) & 0x1F).astype(np.float32) * (255.0 / 31)
+        g = ((region >> 5) & 0x3F).astype(np.float32) * (255.0 / 63)
+        b = (region & 0x1F).astype(np.float32) * (255.0 / 31)
+        r += (colour[0] - r) * a
+        g += (colour[1] - g) * a
+        b += (colour[2] - b) * a
+        region[:] = ((r.astype(np.uint16) & 0xF8) << 8) | ((g.astype(np.uint16) & 0xFC) << 3) | (b.astype(np.uint16) >> 3)
+        return frame
+
+
+@functools.lru_cache(maxsize=8)
+def atlas(font_path, size):
+    # One shared atlas per font and size
+    return GlyphAtlas(font_path, size)
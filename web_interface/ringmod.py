@@ -0,0 +1,154 @@
+import functools
+
+import numpy as np
+
+
+def diode(v, VB, VL, H):
+    """
+    Diode transfer curve used by the ring modulator model
+    (http://recherche.ircam.fr/pub/dafx11/Papers/66_e.pdf): no current up
+    to VB, a quadratic knee between VB and VL and linear above VL.
+    Evaluated on whole arrays at once.
+    """
+    v = np.asarray(v)
+    if not np.issubdtype(v.dtype, np.floating):
+        v = v.astype(np.float64)
+    knee = H * ((v - VB)**2)/(2*VL - 2*VB)
+    linear = H*v - H*VL + (H*(VL-VB)**2)/(2*VL-2*VB)
+    return np.where(v <= VB, 0.0, np.where(v <= VL, knee, linear)).astype(v.dtype, copy=False)
+
+
+@functools.lru_cache(maxsize=16)
+def diode_lookup(n_samples, VB, VL, H):
+    # Table of the curve over |v| for v in [-1, 1), as used by Waveshaper.
+    # Memoized, so it is read-only and shared between calls.
+    v = np.abs((np.arange(n_samples) - n_samples/2) / (n_samples/2))
+    table = diode(v, VB, VL, H)
+    table.flags.writeable = False
+    return table
+
+
+def raw_diode(signal, VB, VL, H):
+    # Exact evaluation of the diode on every sample of a signal
+    return diode(signal, VB, VL, H)
+
+
+def diode_pair(signal, VB, VL, H):
+    """
+    Exact counterpart of diode.transform(x) + diode.transform(-x) with a
+    Waveshaper built on diode_lookup: same input normalization, but the
+    curve is evaluated instead of being looked up in the table.
+    """
+    max_val = np.max(np.abs(signal))
+    if max_val >= 1.0:
+        signal = signal / max_val
+    return 2.0 * raw_diode(np.abs(signal), VB, VL, H)
+
+
+def ring_modulate(data, rate, mod_f, diode_pair):
+    """
+    Ring modulate a mono signal normalized to -1.0 < data < 1.0 with a sine
+    carrier of mod_f Hz. diode_pair(x) must return the diode response
+    d(x) + d(-x), e.g. Waveshaper.transform_pair or the exact diode_pair.
+    Returns float32 scaled to a peak of 1.0.
+    """
+    data = np.asarray(data, dtype=np.float32)
+    # Carrier gained by 1/2
+    tone = np.sin(2*np.pi*np.arange(data.shape[0])*mod_f/rate).astype(np.float32)
+    tone *= 0.5
+    # Sum the paths: carrier plus signal on top, inverted carrier on the bottom
+    result = diode_pair(data + tone)
+    result -= diode_pair(data - tone)
+    peak = np.max(np.abs(result)) if result.size else 0.0
+    if peak > 0:
+        result /= peak
+    return result
+
+
+class PeakNormalizer():
+    """
+    Running peak follower for block processing. The peak jumps up to the
+    largest sample of a block at once and decays back down with the release
+    time constant, never below floor. normalize() divides a block by the
+    peak in place and returns the peak it used.
+    """
+    def __init__(self, rate, release=2.0, floor=1e-3):
+        self.rate = rate
+        self.release = release
+        self.floor = floor
+        self.peak = floor
+
+    def normalize(self, block):
+        decay = np.exp(-block.shape[0] / (self.release * self.rate))
+        block_peak = float(np.max(np.abs(block))) if block.size else 0.0
+        self.peak = max(self.peak * decay, block_peak, self.floor)
+        block /= self.peak
+        return self.peak
+
+
+class StreamingRingModulator():
+    """
+    Block by block version of ring_modulate(). The carrier phase is carried
+    from one block to the next and the global maxima are replaced by running
+    peak normalizers, so blocks can be played as soon as they are processed
+    and memory does not grow with the length of the signal. The input is
+    scaled into the diode's (-1, 1) range with a fixed headroom instead of
+    per call, which keeps the diode behaviour the same for every block.
+    """
+    def __init__(self, rate, mod_f, diode_pair, release=2.0):
+        self.rate = rate
+        self.step = 2*np.pi*mod_f/rate
+        self.diode_pair = diode_pair
+        self.phase = 0.0
+        self.input_peak = PeakNormalizer(rate, release, floor=1e-2)
+        self.output_peak = PeakNormalizer(rate, release)
+
+    def process(self, block):
+        # block: float samples in -1.0..1.0 of full scale; returns float32 at the input level
+        data = np.array(block, dtype=np.float32)
+        level = self.input_peak.normalize(data)
+        tone = np.sin(self.phase + self.step*np.arange(data.shape[0])).astype(np.float32)
+        self.phase = (self.phase + self.step*data.shape[0]) % (2*np.pi)
+        # carrier gained by 1/2; |data +- tone| <= 1.5 is scaled below 1 for the diode
+        tone *= 0.5
+        data /= 1.5
+        tone /= 1.5
+        result = self.diode_pair(data + tone)
+        result -= self.diode_pair(data - tone)
+        self.output_peak.normalize(result)
+        result *= level
+        return result
+
+
+def robotvoice_samples(pcm, rate, mod_f, diode_pair):
+    """
+    Robot voice of a whole utterance: takes int16 PCM blocks (e.g. from a
+    TTS backend), ring modulates them at once and returns int16 samples at
+    the volume of the input.
+    """
+    blocks = list(pcm)
+    data = np.concatenate(blocks) if blocks else np.zeros(0, dtype=np.int16)
+
+    # get max value to scale to original volume at the end
+    data = data.astype(np.float32)
+    scaler = np.max(np.abs(data)) if data.size else 0
+    if scaler == 0:
+        return np.zeros(0, dtype=np.int16)
+
+    # Normalize to floats in range -1.0 < data < 1.0
+    data /= scaler
+
+    result = ring_modulate(data, rate, mod_f, diode_pair)
+
+    # now scale to max value of input file
+    result *= scaler
+    return result.astype(np.int16)
+
+
+def robotvoice_blocks(pcm, rate, mod_f, diode_pair):
+    # Streaming counterpart of robotvoice_samples: yields int16 blocks as soon as they are ready
+    modulator = StreamingRingModulator(rate, mod_f, diode_pair)
+    for block in pcm:
+        result = modulator.process(block / 32768.0)
+        result *= 32767
+        yield result.astype(np.int16)
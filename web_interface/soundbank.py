@@ -0,0 +1,161 @@
+import os
+import threading
+import time
+from collections import OrderedDict
+
+import pygame
+
+
+class SoundBank():
+    """
+    Sound clips of a folder decoded into pygame.mixer.Sound objects, so that
+    playing one needs no disk access or decoding. A background preload
+    decodes the clips smallest first while they fit in the memory budget;
+    clips loaded later evict the least recently played ones.
+
+    Clips are played on a pool of mixer channels, so short effects can
+    overlap; when all of them are busy the one playing longest is reused.
+    A long clip (a file above stream_file_bytes) which is not in memory yet
+    is streamed through pygame.mixer.music instead and decoded in the
+    background for the next time.
+    """
+    def __init__(self, folder, memory_bytes=64*1024*1024, channels=8, first_channel=0,
+                 extension=".ogg", stream_file_bytes=1024*1024):
+        self.folder = folder
+        self.memory_bytes = memory_bytes
+        self.extension = extension
+        self.stream_file_bytes = stream_file_bytes
+        self.sounds = OrderedDict()
+        self.used = 0
+        self.lock = threading.Lock()
+        self.loading = set()
+        pygame.mixer.set_num_channels(max(pygame.mixer.get_num_channels(), first_channel + channels))
+        self.channels = [pygame.mixer.Channel(i) for i in range(first_channel, first_channel + channels)]
+        self.started = [0.0] * channels
+        self.hits = 0
+        self.loads = 0
+        self.evictions = 0
+        self.streamed = 0
+
+    def path(self, name):
+        return os.path.join(self.folder, name + self.extension)
+
+    def clips(self):
+        return sorted(os.path.splitext(item)[0] for item in os.listdir(self.folder)
+                      if item.endswith(self.extension))
+
+    def sound_bytes(self, sound):
+        frequency, size, channels = pygame.mixer.get_init()
+        return int(sound.get_length() * frequency * channels * abs(size) // 8)
+
+    def load(self, name):
+        # Decode a clip into the bank (unless it is there already) and return it
+        with self.lock:
+            entry = self.sounds.get(name)
+            if entry is not None:
+                self.sounds.move_to_end(name)
+                return entry[0]
+        sound = pygame.mixer.Sound(self.path(name))
+        size = self.sound_bytes(sound)
+        with self.lock:
+            if name not in self.sounds and size <= self.memory_bytes:
+                self.sounds[name] = (sound, size)
+                self.used += size
+                self.loads += 1
+                while self.used > self.memory_bytes:
+                    old, (old_sound, old_size) = self.sounds.popitem(last=False)
+                    self.used -= old_size
+                    self.evictions += 1
+        return sound
+
+    def load_async(self, name):
+        with self.lock:
+            if name in self.loading:
+                return
+            self.loading.add(name)
+
+        def run():
+            try:
+                self.load(name)
+            except Exception as e:
+                print("Sound bank load failed:", name, e)
+            finally:
+                with self.lock:
+                    self.loading.discard(name)
+
+        threading.Thread(target=run, name="Sound load " + name, daemon=True).start()
+
+    def preload(self):
+        # Smallest files first, until the budget is used up; returns the thread
+        def run():
+            start = time.monotonic()
+            clips = sorted(self.clips(), key=lambda name: os.path.getsize(self.path(name)))
+            for name in clips:
+                try:
+                    sound = pygame.mixer.Sound(self.path(name))
+                except Exception as e:
+                    print("Sound bank load failed:", name, e)
+                    continue
+                size = self.sound_bytes(sound)
+                with self.lock:
+                    if self.used + size > self.memory_bytes:
+                        break
+                    if name not in self.sounds:
+                        # preloaded clips are the first to go when space is needed
+                        self.sounds[name] = (sound, size)
+                        self.sounds.move_to_end(name, last=False)
+                        self.used += size
+                        self.loads += 1
+            print("Sound bank preloaded in %.1f s:" % (time.monotonic() - start), self.stats())
+
+        thread = threading.Thread(target=run, name="Sound preload", daemon=True)
+        thread.start()
+        return thread
+
+    def channel(self):
+        # An idle pool channel, or the one which has been playing longest
+        for i, channel in enumerate(self.channels):
+            if not channel.get_busy():
+                return i
+        return min(range(len(self.channels)), key=lambda i: self.started[i])
+
+    def play(self, name, volume=1.0):
+        """
+        Play a clip; returns the channel it plays on, or None when it was
+        streamed through pygame.mixer.music.
+        """
+        with self.lock:
+            entry = self.sounds.get(name)
+            if entry is not None:
+                self.sounds.move_to_end(name)
+                self.hits += 1
+        if entry is not None:
+            sound = entry[0]
+        elif os.path.getsize(self.path(name)) > self.stream_file_bytes:
+            pygame.mixer.music.load(self.path(name))
+            pygame.mixer.music.set_volume(volume)
+            pygame.mixer.music.play()
+            with self.lock:
+                self.streamed += 1
+            self.load_async(name)
+            return None
+        else:
+            sound = self.load(name)
+        with self.lock:
+            i = self.channel()
+            self.started[i] = time.monotonic()
+        channel = self.channels[i]
+        channel.set_volume(volume)
+        channel.play(sound)
+        return channel
+
+    def stats(self):
+        with self.lock:
+            return {
+                'clips': len(self.sounds),
+                'bytes': self.used,
+                'hits': self.hits,
+                'loads': self.loads,
+                'evictions': self.evictions,
+                'streamed': self.streamed,
+            }
@@ -0,0 +1,137 @@
+import hashlib
+import os
+import struct
+import threading
+
+try:
+    import inotify_simple
+except ImportError:
+    inotify_simple = None
+
+OGG_PAGE = struct.Struct('<4sBBqIII')  # capture pattern, version, flags, granule position, ...
+TAIL_BYTES = 65536
+
+
+def parse_name(stem):
+    """
+    Group, display name and duration (seconds, 0 if unknown) encoded in a
+    clip name: [group]_[name]_[milliseconds], [name]_[milliseconds] or
+    [group]_[name].
+    """
+    parts = stem.split('_')
+    group, name, seconds = "Other", stem, 0
+    if len(parts) == 2:
+        if parts[1].isdigit():
+            name = parts[0]
+            seconds = float(parts[1])/1000.0
+        else:
+            group, name = parts
+    elif len(parts) == 3:
+        group, name = parts[0], parts[1]
+        if parts[2].isdigit():
+            seconds = float(parts[2])/1000.0
+    return group, name, seconds
+
+
+def ogg_duration(path):
+    """
+    Length in seconds of an Ogg Vorbis or Opus file, from the sample rate
+    in its identification header and the granule position of its last
+    page. Returns None when the file cannot be parsed.
+    """
+    try:
+        with open(path, 'rb') as f:
+            head = f.read(OGG_PAGE.size + 255 + 64)
+            f.seek(0, os.SEEK_END)
+            size = f.tell()
+            f.seek(max(0, size - TAIL_BYTES))
+            tail = f.read()
+    except OSError:
+        return None
+    if len(head) < OGG_PAGE.size + 1 or not head.startswith(b'OggS'):
+        return None
+    # the first packet starts after the page header and its segment table
+    packet = OGG_PAGE.size + 1 + head[OGG_PAGE.size]
+    if head[packet:packet+7] == b'\x01vorbis':
+        rate = struct.unpack_from('<I', head, packet + 12)[0]
+    elif head[packet:packet+8] == b'OpusHead':
+        rate = 48000
+    else:
+        return None
+    last = tail.rfind(b'OggS')
+    if rate == 0 or last < 0 or last + OGG_PAGE.size > len(tail):
+        return None
+    granule = OGG_PAGE.unpack_from(tail, last)[3]
+    if granule < 0:
+        return None
+    return granule / rate
+
+
+class SoundLibrary():
+    """
+    Index of the clips in the sound folder for the web interface, as
+    (group, file, name, seconds) tuples sorted by file name. It is built
+    once and refreshed when the folder changes: through inotify when
+    inotify_simple is installed, otherwise when the folder mtime changes.
+    Only new or modified files are parsed again. The etag changes with the
+    contents of the index.
+    """
+    def __init__(self, folder, extension=".ogg"):
+        self.folder = folder
+        self.extension = extension
+        self.lock = threading.Lock()
+        self.entries = {}
+        self.items = []
+        self.etag = None
+        self.folder_mtime = None
+        self.watch = None
+        if inotify_simple is not None:
+            try:
+                flags = inotify_simple.flags
+                self.watch = inotify_simple.INotify()
+                self.watch.add_watch(folder, flags.CREATE | flags.DELETE | flags.MOVED_TO |
+                                     flags.MOVED_FROM | flags.CLOSE_WRITE)
+            except OSError:
+                self.watch = None
+        self.scan()
+
+    def changed(self):
+        if self.watch is not None:
+            return bool(self.watch.read(timeout=0))
+        try:
+            return os.stat(self.folder).st_mtime != self.folder_mtime
+        except OSError:
+            return True
+
+    def scan(self):
+        try:
+            self.folder_mtime = os.stat(self.folder).st_mtime
+            names = [item for item in os.listdir(self.folder) if item.endswith(self.extension)]
+        except OSError:
+            names = []
+        entries = {}
+        for item in names:
+            try:
+                st = os.stat(os.path.join(self.folder, item))
+            except OSError:
+                continue
+            signature = (st.st_mtime, st.st_size)
+            entry = self.entries.get(item)
+            if entry is None or entry[0] != signature:
+                stem = os.path.splitext(item)[0]
+                group, name, seconds = parse_name(stem)
+                duration = ogg_duration(os.path.join(self.folder, item))
+                if duration is not None:
+                    seconds = round(duration, 3)
+                entry = (signature, (group, stem, name, seconds))
+            entries[item] = entry
+        self.entries = entries
+        self.items = [entries[item][1] for item in sorted(entries)]
+        self.etag = hashlib.sha1(repr(self.items).encode('utf-8')).hexdigest()
+
+    def refresh(self):
+        # Returns (items, etag), rescanning first if the folder changed
+        with self.lock:
+            if self.changed():
+                self.scan()
+            return self.items, self.etag
@@ -0,0 +1,62 @@
+import numpy as np
+from PIL import ImageColor
+
+from glyphatlas import atlas
+
+MARGIN = 2
+GAP = "   "
+ELLIPSIS = "..."
+
+
+class TextTicker():
+    """
+    A line of text (TTS caption, IP address, ...) scrolled by the OLED
+    controller itself. The band is rendered and written to GRAM once; the
+    SSD1351 horizontal scroll then rotates it, so a running ticker costs no
+    SPI traffic at all. As the controller can only rotate the visible
+    columns, text wider than one screen is cut short with an ellipsis.
+    """
+    def __init__(self, oled, font_path, size=10, row=12, height=12, colour="WHITE",
+                 background="BLACK", direction=-1, speed=None):
+        self.oled = oled
+        self.atlas = atlas(font_path, size)
+        self.row = row
+        self.height = height
+        self.colour = colour
+        r, g, b = ImageColor.getrgb(background)[:3]
+        self.background = ((r & 0xF8) << 8) | ((g & 0xFC) << 3) | (b >> 3)
+        self.direction = direction
+        self.speed = oled.SCROLL_NORMAL if speed is None else speed
+        self.text = None
+        self.band = None
+
+    def fit(self, text):
+        # The longest start of text (ending in an ellipsis if shortened)
+        # which fits one screen width with the gap that keeps the ends apart
+        room = self.oled.SSD1351_WIDTH - MARGIN - self.atlas.width(GAP)
+        if self.atlas.width(text) <= room:
+            return text
+        room -= self.atlas.width(ELLIPSIS)
+        end = 0
+        width = 0.0
+        for char in text:
+            width += self.atlas.glyph(char)[3]
+            if width > room:
+                break
+            end += 1
+        return text[:end].rstrip() + ELLIPSIS
+
+    def render(self, text):
+        # The controller rotates the 128 visible columns, so the text wraps
+        # around after one screen width; the spaces keep the ends apart
+        if text != self.text:
+            band = np.full((self.height, self.oled.SSD1351_WIDTH), self.background, dtype=np.uint16)
+            self.band = self.atlas.draw_text(band, (MARGIN, 0), self.fit(text) + GAP, self.colour)
+            self.text = text
+        return self.band
+
+    def show(self, text):
+        self.oled.Start_Ticker(self.render(text), self.row, self.direction, self.speed)
+
+    def hide(self):
+        self.oled.Stop_Scroll()
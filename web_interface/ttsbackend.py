@@ -0,0 +1,300 @@
+import io
+import queue
+import shutil
+import struct
+import subprocess
+import threading
+import time
+from collections import deque
+
+import numpy as np
+
+# RIFF header of the wav stream written by espeak-ng --stdout
+WAV_HEADER = struct.Struct('<4sI4s4sIHHIIHH4sI')
+
+
+def feed_process(proc, chunks, name):
+    # Write chunks to the stdin of proc from a helper thread, then close it.
+    # An exception raised by chunks is kept in the error attribute of the thread.
+    def feed():
+        try:
+            for chunk in chunks:
+                proc.stdin.write(chunk)
+        except Exception as e:
+            print("TTS feed error:", e)
+            feeder.error = e
+        finally:
+            try:
+                proc.stdin.close()
+            except OSError:
+                pass
+    feeder = threading.Thread(target=feed, name=name, daemon=True)
+    feeder.error = None
+    feeder.start()
+    return feeder
+
+
+def read_blocks(stream, block_size):
+    # int16 blocks of block_size samples (the last one may be shorter)
+    while True:
+        data = stream.read(block_size * 2)
+        if not data:
+            break
+        yield np.frombuffer(data[:len(data) // 2 * 2], dtype=np.int16)
+
+
+def ffmpeg_pcm(chunks, rate, block_size):
+    """
+    Decode encoded audio (mp3, wav, ...) to mono signed 16 bit PCM at the
+    given rate. The chunks are fed to ffmpeg while PCM blocks are read back,
+    so the first block is available before the input is complete. When
+    the chunks fail (e.g. gTTS without network), their exception is raised
+    once the decoded audio has been read.
+    """
+    proc = subprocess.Popen(["ffmpeg", "-loglevel", "error", "-i", "pipe:0",
+                             "-f", "s16le", "-ac", "1", "-ar", str(rate), "pipe:1"],
+                            stdin=subprocess.PIPE, stdout=subprocess.PIPE)
+    feeder = feed_process(proc, chunks, "TTS decode")
+    try:
+        yield from read_blocks(proc.stdout, block_size)
+        feeder.join()
+        if feeder.error is not None:
+            raise feeder.error
+    finally:
+        proc.kill()
+        proc.wait()
+        feeder.join()
+
+
+class GTTSBackend():
+    """
+    Google Translate text-to-speech. Needs the network; long texts are
+    fetched in parts, and each part is decoded as soon as it arrives.
+    """
+    name = "gtts"
+
+    def available(self):
+        try:
+            import gtts
+        except ImportError:
+            return False
+        return shutil.which("ffmpeg") is not None
+
+    def chunks(self, tts):
+        if hasattr(tts, "stream"):
+            return tts.stream()
+        mp3 = io.BytesIO()
+        tts.write_to_fp(mp3)
+        return [mp3.getvalue()]
+
+    def stream(self, lang, text, rate, block_size):
+        import gtts
+        return ffmpeg_pcm(self.chunks(gtts.gTTS(text, lang=lang)), rate, block_size)
+
+
+class EspeakBackend():
+    """
+    Local synthesis with espeak-ng, which works offline and starts in a few
+    milliseconds. Its PCM is used as is when it already has the requested
+    rate, otherwise it is resampled by ffmpeg.
+    """
+    name = "espeak"
+
+    def __init__(self, command="espeak-ng", speed=None):
+        self.command = command
+        self.speed = speed
+
+    def available(self):
+        return shutil.which(self.command) is not None
+
+    def stream(self, lang, text, rate, block_size):
+        args = [self.command, "--stdout", "-v", lang or "en"]
+        if self.speed is not None:
+            args += ["-s", str(self.speed)]
+        # the text goes through stdin so it is never taken for an option
+        proc = subprocess.Popen(args, stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+                                stderr=subprocess.DEVNULL)
+        feeder = feed_process(proc, [text.encode('utf-8')], "TTS text")
+        try:
+            header = proc.stdout.read(WAV_HEADER.size)
+            if len(header) < WAV_HEADER.size:
+                return
+            fields = WAV_HEADER.unpack(header)
+            source_rate = fields[7]
+            if fields[0] != b'RIFF' or fields[5] != 1 or fields[6] != 1 or fields[10] != 16:
+                raise ValueError("Unexpected wav format from " + self.command)
+            if source_rate == rate:
+                yield from read_blocks(proc.stdout, block_size)
+            else:
+                rest = iter(lambda: proc.stdout.read(4096), b'')
+                yield from ffmpeg_pcm(_prepend(header, rest), rate, block_size)
+        finally:
+            proc.kill()
+            proc.wait()
+            feeder.join()
+
+
+def _prepend(first, rest):
+    yield first
+    yield from rest
+
+
+class BackendStats():
+    def __init__(self, history=50):
+        self.requests = 0
+        self.failures = 0
+        self.timeouts = 0
+        self.first_block = deque(maxlen=history)
+        self.synthesis = deque(maxlen=history)
+        self.cooldown_until = 0.0
+
+    def summary(self):
+        first = np.array(self.first_block) * 1000.0
+        total = np.array(self.synthesis) * 1000.0
+        return {
+            'requests': self.requests,
+            'failures': self.failures,
+            'timeouts': self.timeouts,
+            'last_first_block_ms': round(float(first[-1]), 1) if first.size else None,
+            'mean_first_block_ms': round(float(first.mean()), 1) if first.size else None,
+            'p95_first_block_ms': round(float(np.percentile(first, 95)), 1) if first.size else None,
+            'mean_synthesis_ms': round(float(total.mean()), 1) if total.size else None,
+            'cooling_down': self.cooldown_until > time.monotonic(),
+        }
+
+
+_DONE = object()
+
+
+class TTSRouter():
+    """
+    Chooses the text-to-speech backend for each utterance. With a fixed mode
+    only that backend is used. In "auto" mode the backends are tried in the
+    given order: one which delivers no audio within first_block_timeout, or
+    ends without any audio, is abandoned for the next, and a backend which timed out, failed or was
+    slower than slow_latency is put at the back of the queue for cooldown
+    seconds. The time to the first PCM block and the time to synthesize
+    the whole text are recorded per backend.
+    """
+    def __init__(self, backends, mode="auto", first_block_timeout=3.0, slow_latency=1.5,
+                 cooldown=60.0, queue_blocks=16):
+        self.backends = {backend.name: backend for backend in backends}
+        self.order = [backend.name for backend in backends]
+        if mode != "auto" and mode not in self.backends:
+            raise ValueError("Unknown TTS backend: " + mode)
+        self.mode = mode
+        self.first_block_timeout = first_block_timeout
+        self.slow_latency = slow_latency
+        self.cooldown = cooldown
+        self.queue_blocks = queue_blocks
+        self.lock = threading.Lock()
+        self.backend_stats = {name: BackendStats() for name in self.order}
+        self.usable = {}
+
+    def is_usable(self, name):
+        if name not in self.usable:
+            self.usable[name] = self.backends[name].available()
+        return self.usable[name]
+
+    def candidates(self):
+        # Backend names in the order they would be tried right now
+        if self.mode != "auto":
+            return [self.mode]
+        now = time.monotonic()
+        names = [name for name in self.order if self.is_usable(name)]
+        with self.lock:
+            return sorted(names, key=lambda name: self.backend_stats[name].cooldown_until > now)
+
+    def open(self, lang, text, rate, block_size):
+        # Returns (backend name, iterator over int16 PCM blocks)
+        errors = []
+        for name in self.candidates():
+            try:
+                return name, self._start(name, lang, text, rate, block_size)
+            except Exception as e:
+                print("TTS backend", name, "failed:", e)
+                errors.append("%s: %s" % (name, e))
+        raise RuntimeError("No TTS backend could synthesize the text (%s)" % "; ".join(errors))
+
+    def stats(self):
+        with self.lock:
+            return {name: stats.summary() for name, stats in self.backend_stats.items()}
+
+    def _record(self, name, first_block=None, synthesis=None, failure=False, timeout=False):
+        with self.lock:
+            stats = self.backend_stats[name]
+            if first_block is not None:
+                stats.first_block.append(first_block)
+            if synthesis is not None:
+                stats.synthesis.append(synthesis)
+            stats.failures += failure
+            stats.timeouts += timeout
+            slow = first_block is not None and first_block > self.slow_latency
+            if failure or timeout or slow:
+                stats.cooldown_until = time.monotonic() + self.cooldown
+
+    def _start(self, name, lang, text, rate, block_size):
+        # The backend runs in its own thread so that a stalled one can be abandoned
+        blocks = queue.Queue(maxsize=self.queue_blocks)
+        cancel = threading.Event()
+        start = time.monotonic()
+        with self.lock:
+            self.backend_stats[name].requests += 1
+
+        def produce():
+            stream = None
+            try:
+                stream = self.backends[name].stream(lang, text, rate, block_size)
+                for block in stream:
+                    while not cancel.is_set():
+                        try:
+                            blocks.put(block, timeout=0.1)
+                            break
+                        except queue.Full:
+                            pass
+                    if cancel.is_set():
+                        break
+                item = _DONE
+            except Exception as e:
+                item = e
+            finally:
+                if stream is not None:
+                    stream.close()
+            while not cancel.is_set():
+                try:
+                    blocks.put(item, timeout=0.1)
+                    break
+                except queue.Full:
+                    pass
+
+        threading.Thread(target=produce, name="TTS " + name, daemon=True).start()
+        try:
+            first = blocks.get(timeout=self.first_block_timeout)
+        except queue.Empty:
+            cancel.set()
+            self._record(name, timeout=True)
+            raise TimeoutError("no audio after %.1f s" % self.first_block_timeout)
+        if isinstance(first, Exception):
+            self._record(name, failure=True)
+            raise first
+        if first is _DONE:
+            self._record(name, failure=True)
+            raise RuntimeError("no audio")
+        self._record(name, first_block=time.monotonic() - start)
+        return self._follow(name, first, blocks, cancel, start)
+
+    def _follow(self, name, item, blocks, cancel, start):
+        try:
+            while item is not _DONE:
+                if isinstance(item, Exception):
+                    self._record(name, failure=True)
+                    raise item
+                yield item
+                try:
+                    item = blocks.get(timeout=self.first_block_timeout)
+                except queue.Empty:
+                    self._record(name, timeout=True)
+                    raise TimeoutError("%s stalled" % name)
+            self._record(name, synthesis=time.monotonic() - start)
+        finally:
+            cancel.set()
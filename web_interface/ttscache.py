@@ -0,0 +1,182 @@
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+
+def phrase_key(*parts):
+    # Content address of a phrase: hash of everything that shapes the audio
+    return hashlib.sha256(repr(parts).encode('utf-8')).hexdigest()
+
+
+class PhraseCache():
+    """
+    Finished robot voice audio (mono int16 PCM) by phrase key. Recently used
+    phrases are kept in memory, every rendered phrase is also stored as a
+    .npy file in the cache folder. Both tiers have a byte budget and evict
+    the least recently used entries; on disk, recency is the file mtime.
+    """
+    def __init__(self, cache_folder, memory_bytes=32*1024*1024, disk_bytes=256*1024*1024):
+        self.cache_folder = cache_folder
+        self.memory_bytes = memory_bytes
+        self.disk_bytes = disk_bytes
+        self.memory = OrderedDict()
+        self.memory_used = 0
+        self.disk = OrderedDict()
+        self.disk_used = 0
+        self.lock = threading.Lock()
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.scan()
+
+    def path(self, key):
+        return os.path.join(self.cache_folder, key + ".npy")
+
+    def scan(self):
+        # Index the files left by earlier runs, oldest first
+        entries = []
+        try:
+            for item in os.listdir(self.cache_folder):
+                if item.endswith(".npy"):
+                    st = os.stat(os.path.join(self.cache_folder, item))
+                    entries.append((st.st_mtime, item[:-4], st.st_size))
+        except OSError:
+            pass
+        with self.lock:
+            for mtime, key, size in sorted(entries):
+                self.disk[key] = size
+                self.disk_used += size
+            self._evict_disk()
+
+    def get(self, key):
+        return self.get_any((key,))
+
+    def get_any(self, keys):
+        # The samples of the first of keys which is cached; one miss if none is
+        for key in keys:
+            samples = self._lookup(key)
+            if samples is not None:
+                return samples
+        with self.lock:
+            self.misses += 1
+        return None
+
+    def _lookup(self, key):
+        # Counts hits, not misses
+        with self.lock:
+            samples = self.memory.get(key)
+            if samples is not None:
+                self.memory.move_to_end(key)
+                self.memory_hits += 1
+                return samples
+            on_disk = key in self.disk
+        if on_disk:
+            try:
+                samples = np.load(self.path(key), allow_pickle=False)
+                if samples.size == 0:
+                    # left by a failed synthesis before empty phrases were refused
+                    os.remove(self.path(key))
+                    samples = None
+                else:
+                    os.utime(self.path(key))
+            except (OSError, ValueError):
+                samples = None
+            with self.lock:
+                if samples is not None:
+                    if key in self.disk:
+                        self.disk.move_to_end(key)
+                    self.disk_hits += 1
+                    self._remember(key, samples)
+                    return samples
+                self._forget_disk(key)
+        return None
+
+    def put(self, key, samples):
+        # Returns the samples as stored; an empty phrase (no audio) is not stored
+        samples = np.ascontiguousarray(samples, dtype=np.int16)
+        samples.flags.writeable = False
+        if samples.size == 0:
+            return samples
+        os.makedirs(self.cache_folder, exist_ok=True)
+        tmp = "%s.%d.%d.tmp" % (self.path(key), os.getpid(), threading.get_ident())
+        try:
+            with open(tmp, 'wb') as out:
+                np.save(out, samples, allow_pickle=False)
+            os.replace(tmp, self.path(key))
+            size = os.path.getsize(self.path(key))
+        except OSError as e:
+            print("TTS cache write failed:", e)
+            size = None
+        finally:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+        with self.lock:
+            if size is not None:
+                self.disk_used -= self.disk.pop(key, 0)
+                self.disk[key] = size
+                self.disk_used += size
+                self._evict_disk()
+            self._remember(key, samples)
+        return samples
+
+    def get_or_render(self, key, render):
+        # render() is only called on a miss and must return the PCM samples
+        samples = self.get(key)
+        if samples is None:
+            samples = self.put(key, render())
+        return samples
+
+    def __contains__(self, key):
+        with self.lock:
+            return key in self.memory or key in self.disk
+
+    def prewarm(self, items):
+        # items: iterable of (keys, render). A phrase counts as cached under
+        # any of its keys; otherwise render() returns (key, samples) to store.
+        rendered = 0
+        for keys, render in items:
+            if not any(key in self for key in keys):
+                try:
+                    if self.put(*render()).size:
+                        rendered += 1
+                except Exception as e:
+                    print("TTS prewarm failed:", e)
+        return rendered
+
+    def stats(self):
+        with self.lock:
+            return {
+                'memory_hits': self.memory_hits,
+                'disk_hits': self.disk_hits,
+                'misses': self.misses,
+                'memory_entries': len(self.memory),
+                'memory_bytes': self.memory_used,
+                'disk_entries': len(self.disk),
+                'disk_bytes': self.disk_used,
+            }
+
+    def _remember(self, key, samples):
+        if key in self.memory:
+            self.memory_used -= self.memory.pop(key).nbytes
+        if samples.nbytes > self.memory_bytes:
+            return
+        self.memory[key] = samples
+        self.memory_used += samples.nbytes
+        while self.memory_used > self.memory_bytes:
+            old_key, old = self.memory.popitem(last=False)
+            self.memory_used -= old.nbytes
+
+    def _forget_disk(self, key):
+        self.disk_used -= self.disk.pop(key, 0)
+
+    def _evict_disk(self):
+        while self.disk_used > self.disk_bytes and self.disk:
+            key, size = self.disk.popitem(last=False)
+            self.disk_used -= size
+            try:
+                os.remove(self.path(key))
+            except OSError:
+                pass
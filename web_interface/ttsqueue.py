@@ -0,0 +1,150 @@
+import itertools
+import threading
+import time
+from collections import OrderedDict, deque
+
+QUEUED = "queued"
+RUNNING = "running"
+DONE = "done"
+CANCELLED = "cancelled"
+FAILED = "failed"
+
+
+class TTSJob():
+    """
+    One utterance. The handler reports its progress with update() and
+    should stop early once cancelled is set.
+    """
+    def __init__(self, job_id, lang, text):
+        self.id = job_id
+        self.lang = lang
+        self.text = text
+        self.state = QUEUED
+        self.progress = {}
+        self.error = None
+        self.submitted = time.monotonic()
+        self.started = None
+        self.finished = None
+        self.event = threading.Event()
+
+    @property
+    def cancelled(self):
+        return self.event.is_set()
+
+    def cancel(self):
+        self.event.set()
+
+    def update(self, **progress):
+        self.progress.update(progress)
+
+    def status(self):
+        def since(t):
+            return round((t - self.submitted) * 1000) if t is not None else None
+        return {
+            'job': self.id,
+            'lang': self.lang,
+            'text': self.text,
+            'state': self.state,
+            'progress': dict(self.progress),
+            'error': self.error,
+            'started_ms': since(self.started),
+            'finished_ms': since(self.finished),
+        }
+
+
+class TTSQueue(threading.Thread):
+    """
+    Runs text-to-speech jobs on a background thread so that the web request
+    can return at once. At most max_pending jobs wait; a job for the same
+    language and text as one already waiting or running is not added again,
+    the existing job is returned instead. With cancel_older, a new job
+    cancels everything submitted before it. The status of the last history
+    jobs stays available by job id.
+    """
+    def __init__(self, handler, max_pending=4, history=32):
+        threading.Thread.__init__(self, daemon=True)
+        self.name = "TTS"
+        self.handler = handler
+        self.max_pending = max_pending
+        self.cond = threading.Condition()
+        self.pending = deque()
+        self.running = None
+        self.jobs = OrderedDict()
+        self.history = history
+        self.counter = itertools.count(1)
+        self.stopping = False
+
+    def submit(self, lang, text, cancel_older=True):
+        # Returns the job, or None when the queue is full
+        with self.cond:
+            for job in itertools.chain([self.running], self.pending):
+                if job is not None and not job.cancelled and (job.lang, job.text) == (lang, text):
+                    return job
+            if cancel_older:
+                self._cancel_all()
+            if len(self.pending) >= self.max_pending:
+                return None
+            job = TTSJob(str(next(self.counter)), lang, text)
+            self.pending.append(job)
+            self.jobs[job.id] = job
+            while len(self.jobs) > self.history:
+                self.jobs.popitem(last=False)
+            self.cond.notify()
+        return job
+
+    def cancel(self, job_id):
+        with self.cond:
+            job = self.jobs.get(job_id)
+            if job is None or job.state not in (QUEUED, RUNNING):
+                return False
+            self._cancel(job)
+            return True
+
+    def _cancel_all(self):
+        for job in list(self.pending):
+            self._cancel(job)
+        if self.running is not None:
+            self.running.cancel()
+
+    def _cancel(self, job):
+        job.cancel()
+        if job.state == QUEUED:
+            self.pending.remove(job)
+            job.state = CANCELLED
+            job.finished = time.monotonic()
+
+    def status(self, job_id=None):
+        with self.cond:
+            if job_id is not None:
+                job = self.jobs.get(job_id)
+                return job.status() if job is not None else None
+            return [job.status() for job in self.jobs.values()]
+
+    def stop(self):
+        with self.cond:
+            self.stopping = True
+            self._cancel_all()
+            self.cond.notify()
+
+    def run(self):
+        while True:
+            with self.cond:
+                while not (self.pending or self.stopping):
+                    self.cond.wait()
+                if self.stopping:
+                    return
+                job = self.pending.popleft()
+                job.state = RUNNING
+                job.started = time.monotonic()
+                self.running = job
+            try:
+                self.handler(job)
+                state = CANCELLED if job.cancelled else DONE
+            except Exception as e:
+                print("TTS job", job.id, "failed:", e)
+                job.error = str(e)
+                state = FAILED
+            with self.cond:
+                job.state = state
+                job.finished = time.monotonic()
+                self.running = None
@@ -0,0 +1,198 @@
+import argparse
+import mmap
+import os
+import struct
+import threading
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+FRAME_WIDTH = 128
+FRAME_HEIGHT = 128
+FRAME_BYTES = FRAME_WIDTH * FRAME_HEIGHT * 2
+
+# magic, version, width, height, fps, frame count, source mtime
+HEADER = struct.Struct('<4sHHHfId')
+HEADER_SIZE = 32
+MAGIC = b'W565'
+VERSION = 1
+
+
+def pack_bgr_frame(frame):
+    """
+    Resize an OpenCV BGR frame to the OLED size and pack it into big-endian
+    RGB565 bytes, ready to be written to the controller GRAM.
+    """
+    import cv2
+    resized = cv2.resize(frame, (FRAME_WIDTH, FRAME_HEIGHT), interpolation=cv2.INTER_AREA)
+    b = resized[..., 0].astype(np.uint16)
+    g = resized[..., 1].astype(np.uint16)
+    r = resized[..., 2].astype(np.uint16)
+    rgb565 = ((r & 0xF8) << 8) | ((g & 0xFC) << 3) | (b >> 3)
+    return rgb565.astype('>u2').tobytes()
+
+
+def transcode(source, target):
+    """
+    Decode a video once and store every frame as raw RGB565. The file is
+    written under a temporary name and renamed, so readers never see a
+    partial cache entry.
+    """
+    import cv2
+    mtime = os.stat(source).st_mtime
+    capture = cv2.VideoCapture(source)
+    fps = capture.get(cv2.CAP_PROP_FPS) or 30.0
+    tmp = "%s.%d.%d.tmp" % (target, os.getpid(), threading.get_ident())
+    count = 0
+    try:
+        with open(tmp, 'wb') as out:
+            out.write(bytes(HEADER_SIZE))
+            while True:
+                ret, frame = capture.read()
+                if not ret:
+                    break
+                out.write(pack_bgr_frame(frame))
+                count += 1
+            out.seek(0)
+            out.write(HEADER.pack(MAGIC, VERSION, FRAME_WIDTH, FRAME_HEIGHT, fps, count, mtime))
+        os.replace(tmp, target)
+    finally:
+        capture.release()
+        if os.path.exists(tmp):
+            os.remove(tmp)
+    return count
+
+
+def read_header(path):
+    # Returns (fps, frame count, source mtime) or None for foreign/old files
+    try:
+        with open(path, 'rb') as f:
+            data = f.read(HEADER.size)
+    except OSError:
+        return None
+    if len(data) < HEADER.size:
+        return None
+    magic, version, width, height, fps, count, mtime = HEADER.unpack(data)
+    if magic != MAGIC or version != VERSION or (width, height) != (FRAME_WIDTH, FRAME_HEIGHT):
+        return None
+    return fps, count, mtime
+
+
+class CachedClip():
+    """
+    A transcoded clip mapped into memory. frame() returns a view straight
+    into the page cache, so playback does no decoding or copying.
+    """
+    def __init__(self, path):
+        header = read_header(path)
+        if header is None:
+            raise ValueError("Not an OLED video cache file: " + path)
+        self.fps, self.frame_count, self.source_mtime = header
+        self.file = open(path, 'rb')
+        self.map = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+        # a truncated file only exposes the frames it really contains
+        self.frame_count = min(self.frame_count, (len(self.map) - HEADER_SIZE) // FRAME_BYTES)
+
+    def __len__(self):
+        return self.frame_count
+
+    def frame(self, index):
+        return np.frombuffer(self.map, dtype='>u2', count=FRAME_WIDTH*FRAME_HEIGHT,
+                             offset=HEADER_SIZE + index*FRAME_BYTES).reshape(FRAME_HEIGHT, FRAME_WIDTH)
+
+    def close(self):
+        self.map.close()
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+class VideoCache():
+    """
+    Keeps one RGB565 cache file per video clip found in the sound folder.
+    An entry is stale when the modification time of its source changes.
+    """
+    def __init__(self, source_folder, cache_folder, extension=".webm"):
+        self.source_folder = source_folder
+        self.cache_folder = cache_folder
+        self.extension = extension
+        self.building = set()
+        self.lock = threading.Lock()
+
+    def source_path(self, name):
+        return os.path.join(self.source_folder, name + self.extension)
+
+    def cache_path(self, name):
+        return os.path.join(self.cache_folder, name + ".rgb565")
+
+    def clips(self):
+        return sorted(os.path.splitext(item)[0] for item in os.listdir(self.source_folder)
+                      if item.endswith(self.extension))
+
+    def is_fresh(self, name):
+        header = read_header(self.cache_path(name))
+        if header is None:
+            return False
+        try:
+            return header[2] == os.stat(self.source_path(name)).st_mtime
+        except OSError:
+            return False
+
+    def build(self, name):
+        os.makedirs(self.cache_folder, exist_ok=True)
+        return transcode(self.source_path(name), self.cache_path(name))
+
+    def build_async(self, name):
+        # Transcode in the background unless a build is already running
+        with self.lock:
+            if name in self.building:
+                return
+            self.building.add(name)
+
+        def run():
+            try:
+                frames = self.build(name)
+                print("Cached", frames, "OLED frames for", name)
+            except Exception as e:
+                print("Unable to cache video", name, e)
+            finally:
+                with self.lock:
+                    self.building.discard(name)
+
+        threading.Thread(target=run, daemon=True).start()
+
+    def open(self, name):
+        # Returns a CachedClip, or None when the entry is missing or stale
+        if not self.is_fresh(name):
+            return None
+        try:
+            return CachedClip(self.cache_path(name))
+        except (OSError, ValueError):
+            return None
+
+    def build_all(self, jobs=None, force=False):
+        names = [name for name in self.clips() if force or not self.is_fresh(name)]
+        os.makedirs(self.cache_folder, exist_ok=True)
+        jobs_list = [(self.source_path(name), self.cache_path(name)) for name in names]
+        with ProcessPoolExecutor(max_workers=jobs) as pool:
+            for name, frames in zip(names, pool.map(_transcode_job, jobs_list)):
+                print("Cached", frames, "OLED frames for", name)
+        return names
+
+
+def _transcode_job(paths):
+    return transcode(*paths)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Prebuild the OLED video cache")
+    parser.add_argument("source_folder", help="folder containing the .webm clips")
+    parser.add_argument("cache_folder", help="folder where the RGB565 files are written")
+    parser.add_argument("-j", "--jobs", type=int, default=None, help="number of parallel transcodes")
+    parser.add_argument("-f", "--force", action="store_true", help="rebuild fresh entries too")
+    args = parser.parse_args()
+    VideoCache(args.source_folder, args.cache_folder).build_all(args.jobs, args.force)
@@ -1,22 +1,67 @@
-import numpy as np
-
-class Waveshaper():
-    """
-    Apply a transform to an audio signal; store transform as curve,
-    use curve as lookup table.  Implementation of jQuery's WaveShaperNode
-    API:
-        http://webaudio.github.io/web-audio-api/#the-waveshapernode-interface
-    """
-    def __init__(self, curve):
-        self.curve = curve
-        self.n_bins = self.curve.shape[0]
-
-    def transform(self, samples):
-        # normalize to 0 < samples < 2
-        max_val = np.max(np.abs(samples))
-        if max_val >= 1.0:
-            result = samples/np.max(np.abs(samples)) + 1.0
-        else:
-            result = samples + 1.0
-        result = result * (self.n_bins-1)/2
-        return self.curve[result.astype(np.int)]
+import numpy as np
+
+class Waveshaper():
+    """
+    Apply a transform to an audio signal; store transform as curve,
+    use curve as lookup table.  Implementation of jQuery's WaveShaperNode
+    API:
+        http://webaudio.github.io/web-audio-api/#the-waveshapernode-interface
+
+    Processing is done in float32. The curve is read either at the nearest
+    bin below the sample ("nearest", as before) or interpolated linearly
+    between bins ("linear"). Every transform takes an optional output
+    buffer, and transform_pair() computes transform(x) + transform(-x) with
+    a single normalization pass and one work buffer.
+    """
+    def __init__(self, curve, interpolation="nearest"):
+        if interpolation not in ("nearest", "linear"):
+            raise ValueError("interpolation must be 'nearest' or 'linear'")
+        self.curve = np.asarray(curve, dtype=np.float32)
+        self.n_bins = self.curve.shape[0]
+        self.interpolation = interpolation
+        # difference to the next bin, for linear interpolation
+        self.slope = np.diff(self.curve, append=self.curve[-1]).astype(np.float32)
+
+    def scale(self, samples):
+        # normalize to 0 < samples < 2, then spread over the bins
+        max_val = np.max(np.abs(samples))
+        norm = 1.0/max_val if max_val >= 1.0 else 1.0
+        return norm * (self.n_bins-1)/2
+
+    def buffer(self, samples, out):
+        if out is None:
+            return np.empty(samples.shape, dtype=np.float32)
+        if out.shape != samples.shape or out.dtype != np.float32:
+            raise ValueError("output buffer must be float32 with the shape of the input")
+        return out
+
+    def lookup(self, samples, factor, out):
+        # out = curve at (samples*factor + centre); out may not alias samples
+        np.multiply(samples, factor, out=out)
+        out += (self.n_bins-1)/2
+        if self.interpolation == "nearest":
+            index = out.astype(np.intp)
+            np.take(self.curve, index, out=out)
+        else:
+            index = np.minimum(out.astype(np.intp), self.n_bins-2)
+            out -= index
+            out *= np.take(self.slope, index)
+            out += np.take(self.curve, index)
+        return out
+
+    def transform(self, samples, out=None):
+        samples = np.asarray(samples)
+        out = self.buffer(samples, out)
+        return self.lookup(samples, self.scale(samples), out)
+
+    def transform_pair(self, samples, out=None, work=None):
+        # transform(samples) + transform(-samples), as used by the ring modulator
+        samples = np.asarray(samples)
+        out = self.buffer(samples, out)
+        work = self.buffer(samples, work)
+        if np.may_share_memory(samples, out) or np.may_share_memory(samples, work):
+            raise ValueError("transform_pair cannot work in place")
+        factor = self.scale(samples)
+        self.lookup(samples, factor, out)
+        out += self.lookup(samples, -factor, work)
+        return out